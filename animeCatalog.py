@@ -0,0 +1,169 @@
+# animeCatalog.py
+# Compact index of anime IDs known to exist on MAL, for /randomanime.
+import asyncio
+import os
+import random
+import struct
+from array import array
+from bisect import bisect_left
+from requestScheduler import BACKGROUND, setPriority
+
+# Small-int codes for the filterable fields. 0 always means unknown.
+STATUS_CODES = {'finished_airing': 1, 'currently_airing': 2, 'not_yet_aired': 3}
+SEASON_CODES = {'winter': 0, 'spring': 1, 'summer': 2, 'fall': 3}
+
+# File header: magic, version, entry count, ranking crawl offset.
+HEADER = struct.Struct("<4sHII")
+MAGIC = b"MALC"
+VERSION = 1
+
+class AnimeCatalog:
+
+    def __init__(self, path=None):
+        # Parallel arrays sorted by id.
+        self.ids = array('I')
+        self.statuses = array('B')
+        self.scores = array('H')   # mean * 100
+        self.seasons = array('H')  # year * 4 + season + 1
+
+        # Where the background crawl picks up again.
+        self.crawl_offset = 0
+
+        self.path = path
+        self.dirty = False
+        if self.path is not None:
+            self.load()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, anime_id):
+        i = bisect_left(self.ids, anime_id)
+        return i < len(self.ids) and self.ids[i] == anime_id
+
+    # Adds or updates every anime in a list of AnimeRecords.
+    # Known values are never overwritten with unknown ones.
+    def addRecords(self, records):
+        for record in records:
+            anime_id = record.id
+            status = STATUS_CODES.get(record.status, 0)
+            score = int(round(record.mean * 100)) if record.mean else 0
+            season = 0
+            if record.start_season and record.start_season[0] in SEASON_CODES:
+                season = record.start_season[1] * 4 + SEASON_CODES[record.start_season[0]] + 1
+
+            i = bisect_left(self.ids, anime_id)
+            if i < len(self.ids) and self.ids[i] == anime_id:
+                if status and self.statuses[i] != status:
+                    self.statuses[i] = status
+                    self.dirty = True
+                if score and self.scores[i] != score:
+                    self.scores[i] = score
+                    self.dirty = True
+                if season and self.seasons[i] != season:
+                    self.seasons[i] = season
+                    self.dirty = True
+            else:
+                self.ids.insert(i, anime_id)
+                self.statuses.insert(i, status)
+                self.scores.insert(i, score)
+                self.seasons.insert(i, season)
+                self.dirty = True
+
+    # Drops an ID that turned out not to exist anymore.
+    def remove(self, anime_id):
+        i = bisect_left(self.ids, anime_id)
+        if i < len(self.ids) and self.ids[i] == anime_id:
+            for column in (self.ids, self.statuses, self.scores, self.seasons):
+                del column[i]
+            self.dirty = True
+
+    # Returns a random known ID, or None if nothing matches.
+    # Without filters this is O(1); filters scan the compact columns.
+    def randomID(self, airing=False, min_score=0, year=None, season=None):
+        if len(self.ids) == 0:
+            return None
+        if not airing and not min_score and year is None and season is None:
+            return self.ids[random.randrange(len(self.ids))]
+
+        airing_code = STATUS_CODES['currently_airing']
+        min_code = int(min_score * 100)
+        season_idx = SEASON_CODES.get(season)
+        candidates = []
+        for i in range(len(self.ids)):
+            if airing and self.statuses[i] != airing_code:
+                continue
+            if min_code and self.scores[i] < min_code:
+                continue
+            if year is not None or season_idx is not None:
+                code = self.seasons[i]
+                if code == 0:
+                    continue
+                code -= 1
+                if year is not None and code // 4 != year:
+                    continue
+                if season_idx is not None and code % 4 != season_idx:
+                    continue
+            candidates.append(i)
+        if len(candidates) == 0:
+            return None
+        return self.ids[random.choice(candidates)]
+
+    # Reads the catalog from disk. A missing or corrupt file starts empty.
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                magic, version, count, crawl_offset = HEADER.unpack(f.read(HEADER.size))
+                if magic != MAGIC or version != VERSION:
+                    return
+                ids, statuses, scores, seasons = array('I'), array('B'), array('H'), array('H')
+                ids.fromfile(f, count)
+                statuses.fromfile(f, count)
+                scores.fromfile(f, count)
+                seasons.fromfile(f, count)
+        except (OSError, EOFError, struct.error):
+            return
+        self.ids, self.statuses, self.scores, self.seasons = ids, statuses, scores, seasons
+        self.crawl_offset = crawl_offset
+        self.dirty = False
+
+    # Writes the catalog to disk if anything changed.
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+        self._write(self._serialize())
+
+    # Async save: serializes on the loop, writes on a worker thread.
+    async def saveAsync(self):
+        if self.path is None or not self.dirty:
+            return
+        await asyncio.to_thread(self._write, self._serialize())
+
+    def _serialize(self):
+        self.dirty = False
+        return b"".join([HEADER.pack(MAGIC, VERSION, len(self.ids), self.crawl_offset),
+                         self.ids.tobytes(), self.statuses.tobytes(),
+                         self.scores.tobytes(), self.seasons.tobytes()])
+
+    def _write(self, data):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    # Background task: slowly walks the popularity ranking to discover IDs
+    # the bot hasn't seen yet, saving every cycle.
+    async def growLoop(self, api, interval=60, pages_per_cycle=1):
+        setPriority(BACKGROUND)
+        while True:
+            for _ in range(pages_per_cycle):
+                page = await api.getAnimeRanking("bypopularity", api.limit_cap, self.crawl_offset)
+                if page == False:
+                    break
+                if len(page) == 0:
+                    self.crawl_offset = 0  # Reached the end, start over.
+                else:
+                    self.crawl_offset += len(page)
+                self.dirty = True
+            await self.saveAsync()
+            await asyncio.sleep(interval)
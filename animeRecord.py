@@ -0,0 +1,137 @@
+# animeRecord.py
+# Compact, slotted anime model built from MAL response JSON.
+import json
+import sys
+
+# Enum-like values are interned so every record shares one string object.
+_intern = sys.intern
+
+class AnimeRecord:
+    __slots__ = ('id', 'title', 'mean', 'num_episodes', 'status', 'media_type',
+                 'start_date', 'end_date', 'start_season', 'rank',
+                 'list_score', 'list_status', 'list_updated_at',
+                 '_picture', '_broadcast', '_alt_titles')
+
+    def __init__(self, anime_id, title):
+        self.id = anime_id
+        self.title = title
+        self.mean = None
+        self.num_episodes = None
+        self.status = None           # finished_airing, currently_airing, not_yet_aired
+        self.media_type = None
+        self.start_date = None
+        self.end_date = None
+        self.start_season = None     # (season, year)
+        self.rank = None             # Ranking responses only.
+        self.list_score = None       # User list responses only.
+        self.list_status = None
+        self.list_updated_at = None
+        # Nested objects are packed into tuples; the properties below
+        # unpack them on access.
+        self._picture = None         # (medium, large)
+        self._broadcast = None       # (day_of_the_week, start_time)
+        self._alt_titles = None      # (en, ja, synonyms)
+
+    # Builds a record from a response node, plus the ranking or list_status
+    # objects that sit beside it in list responses.
+    @classmethod
+    def fromNode(cls, node, ranking=None, list_status=None):
+        record = cls(node['id'], node.get('title', ""))
+        record.mean = node.get('mean')
+        record.num_episodes = node.get('num_episodes')
+        status = node.get('status')
+        record.status = _intern(status) if status else None
+        media_type = node.get('media_type')
+        record.media_type = _intern(media_type) if media_type else None
+        record.start_date = node.get('start_date')
+        record.end_date = node.get('end_date')
+        start_season = node.get('start_season')
+        if start_season:
+            record.start_season = (_intern(start_season['season']), start_season['year'])
+        picture = node.get('main_picture')
+        if picture:
+            record._picture = (picture.get('medium'), picture.get('large'))
+        broadcast = node.get('broadcast')
+        if broadcast:
+            day = broadcast.get('day_of_the_week')
+            record._broadcast = (_intern(day) if day else None, broadcast.get('start_time'))
+        alt_titles = node.get('alternative_titles')
+        if alt_titles:
+            record._alt_titles = (alt_titles.get('en') or None, alt_titles.get('ja') or None,
+                                  tuple(alt_titles.get('synonyms') or ()))
+        if ranking is not None:
+            record.rank = ranking.get('rank')
+        if list_status is not None:
+            record.list_score = list_status.get('score')
+            list_state = list_status.get('status')
+            record.list_status = _intern(list_state) if list_state else None
+            record.list_updated_at = list_status.get('updated_at')
+        return record
+
+    def __repr__(self):
+        return f"AnimeRecord(id={self.id}, title={self.title!r})"
+
+    # Cover image URL (medium size), or None.
+    @property
+    def picture(self):
+        return self._picture[0] if self._picture else None
+
+    # (day_of_the_week, start_time) in JST. Either may be None.
+    @property
+    def broadcast(self):
+        return self._broadcast or (None, None)
+
+    # Every alternative title (English, Japanese, synonyms), skipping blanks.
+    @property
+    def alt_titles(self):
+        if not self._alt_titles:
+            return ()
+        en, ja, synonyms = self._alt_titles
+        return tuple(name for name in (en, ja) + synonyms if name)
+
+    # Anime fields back in MAL's node shape, for storage. List and ranking
+    # fields are per-request, so they're left out.
+    def toNode(self):
+        node = {'id': self.id, 'title': self.title}
+        for field in ('mean', 'num_episodes', 'status', 'media_type', 'start_date', 'end_date'):
+            value = getattr(self, field)
+            if value is not None:
+                node[field] = value
+        if self.start_season is not None:
+            node['start_season'] = {'season': self.start_season[0], 'year': self.start_season[1]}
+        if self._picture:
+            node['main_picture'] = {'medium': self._picture[0], 'large': self._picture[1]}
+        if self._broadcast:
+            node['broadcast'] = {'day_of_the_week': self._broadcast[0], 'start_time': self._broadcast[1]}
+        if self._alt_titles:
+            en, ja, synonyms = self._alt_titles
+            node['alternative_titles'] = {'en': en or "", 'ja': ja or "", 'synonyms': list(synonyms)}
+        return node
+
+# Response parsers. Each takes raw response bytes or decoded JSON.
+def _decode(raw):
+    if isinstance(raw, (bytes, str)):
+        return json.loads(raw)
+    return raw
+
+# Single anime (/anime/{id}).
+def parseAnime(raw):
+    return AnimeRecord.fromNode(_decode(raw))
+
+# List endpoints (/anime, /anime/season). Returns (records, has_next).
+def parseNodeList(raw):
+    data = _decode(raw)
+    records = [AnimeRecord.fromNode(item['node']) for item in data['data']]
+    return records, 'next' in data.get('paging', {})
+
+# /anime/ranking. Returns (records, has_next).
+def parseRanking(raw):
+    data = _decode(raw)
+    records = [AnimeRecord.fromNode(item['node'], ranking=item.get('ranking')) for item in data['data']]
+    return records, 'next' in data.get('paging', {})
+
+# /users/{name}/animelist. Returns (records, has_next).
+def parseUserList(raw):
+    data = _decode(raw)
+    records = [AnimeRecord.fromNode(item['node'], list_status=item.get('list_status')) for item in data['data']]
+    return records, 'next' in data.get('paging', {})
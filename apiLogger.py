@@ -0,0 +1,109 @@
+# apiLogger.py
+# JSON-lines logger that batches writes on a background thread, so logging
+# never does disk I/O on the event loop.
+import json
+import os
+import queue
+import threading
+from datetime import date, datetime
+
+class ApiLogger:
+
+    def __init__(self, log_dir=".", max_bytes=10 * 1024 * 1024, backup_count=5,
+                 max_queue=10000, batch_size=500, block=False):
+        # Files are named {YYYYMMDD}_api_log.jsonl and roll over at midnight
+        # or once they pass max_bytes (older parts get .1, .2, ...).
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        os.makedirs(self.log_dir, exist_ok=True)
+
+        # When the queue is full records are dropped (and counted) unless
+        # block is set, in which case the caller waits for space.
+        self.block = block
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+
+        self._file = None
+        self._file_path = None
+        self._thread = threading.Thread(target=self._run, name="api-logger", daemon=True)
+        self._thread.start()
+
+    # Queues one record. Extra keyword fields are included as-is.
+    def log(self, msg, level="error", **fields):
+        record = {'time': datetime.now().isoformat(timespec="milliseconds"),
+                  'level': level,
+                  'msg': msg}
+        record.update(fields)
+        try:
+            if self.block:
+                self._queue.put(record)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # Path of the file records should go to right now.
+    def currentPath(self):
+        return os.path.join(self.log_dir, f"{date.today().strftime('%Y%m%d')}_api_log.jsonl")
+
+    # Writer thread: waits for a record, then drains whatever else is
+    # queued and writes it all in one go. None is the stop signal.
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            records = [record for record in batch if record is not None]
+            if records:
+                self._write(records)
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def _write(self, records):
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in records)
+        try:
+            self._openFile()
+            self._file.write(lines)
+            self._file.flush()
+            self.written += len(records)
+        except OSError:
+            self.dropped += len(records)
+
+    # Opens today's file, rotating by date or size first if needed.
+    def _openFile(self):
+        path = self.currentPath()
+        if self._file is not None and (path != self._file_path or self._file.tell() >= self.max_bytes):
+            self._file.close()
+            self._file = None
+            if path == self._file_path:
+                self._rotate(path)
+        if self._file is None:
+            self._file = open(path, "a", encoding="utf-8")
+            self._file_path = path
+
+    # Shifts path -> path.1 -> path.2 ..., dropping the oldest.
+    def _rotate(self, path):
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+
+    # Writes out everything queued and stops the thread.
+    def close(self, timeout=5):
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
@@ -0,0 +1,228 @@
+# benchmark.py
+# Load test for the bot's command handlers against a local MAL stand-in.
+# Drives the real slash-command callbacks from discordBot.py with fake
+# interactions and reports throughput, latency percentiles and MAL calls
+# per command. Results can be saved as JSON and compared between runs.
+#
+# Usage: python benchmark.py --requests 200 --concurrency 20 --output run.json
+#        python benchmark.py --compare run.json
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from fakeMal import FakeMAL
+
+# Fake Discord objects. They only record what the handlers send.
+class FakeUser:
+    id = 1
+    name = "benchmark"
+
+class FakeMessage:
+    async def edit(self, **kwargs):
+        pass
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, **kwargs):
+        self._done = True
+        self._interaction.acknowledge()
+
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        self._interaction.reply(content)
+
+    async def edit_message(self, content=None, **kwargs):
+        self._done = True
+        self._interaction.reply(content)
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self._interaction.reply(content)
+        return FakeMessage()
+
+class FakeInteraction:
+    def __init__(self):
+        self.user = FakeUser()
+        self.guild = None
+        self.extras = {}
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.created = time.perf_counter()
+        self.acknowledged_at = None
+        self.replies = []
+
+    def acknowledge(self):
+        if self.acknowledged_at is None:
+            self.acknowledged_at = time.perf_counter()
+
+    def reply(self, content):
+        self.acknowledge()
+        self.replies.append(content)
+
+    async def original_response(self):
+        return FakeMessage()
+
+    async def edit_original_response(self, content=None, **kwargs):
+        self.reply(content)
+        return FakeMessage()
+
+# Returns the p-th percentile (0-100) of a list of numbers.
+def percentile(values, p):
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[index]
+
+# Command name -> function(rng, fake) returning the callback's kwargs.
+def buildScenarios(bot, fake):
+    ids = sorted(fake.anime)
+    popular = ids[:200]  # Most lookups go to a small hot set, like real traffic.
+    airing = [a['id'] for a in fake.anime.values() if a['status'] == "currently_airing"]
+    titles = [a['title'] for a in fake.anime.values()]
+    users = [f"user{i}" for i in range(50)]
+
+    def pickId(rng):
+        return rng.choice(popular) if rng.random() < 0.8 else rng.choice(ids)
+
+    return {
+        'animebyname': lambda rng: {'query': " ".join(rng.choice(titles).split()[:2])},
+        'animebyid': lambda rng: {'anime_id': str(pickId(rng))},
+        'animeranking': lambda rng: {'rank_type': rng.choice(list(bot.Rankings))},
+        'animebyseason': lambda rng: {'season': rng.choice(list(bot.Seasons)), 'year': rng.randint(2018, 2026),
+                                      'sort': bot.SeasonSort.anime_score},
+        'randomanime': lambda rng: {},
+        'nextepisode': lambda rng: {'anime_id': str(rng.choice(airing))},
+        'getuseranimelist': lambda rng: {'user_name': rng.choice(users), 'status': bot.Status.all,
+                                         'sort': bot.ListSort.list_score},
+        'compare': lambda rng: {'user_a': rng.choice(users), 'user_b': rng.choice(users)},
+    }
+
+# Runs one command `total` times at the given concurrency.
+async def runScenario(bot, fake, name, make_args, total, concurrency, rng):
+    command = bot.client.tree.get_command(name)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    ack_latencies = []
+    errors = 0
+    calls_before = fake.totalCalls()
+
+    async def one(kwargs):
+        nonlocal errors
+        async with semaphore:
+            interaction = FakeInteraction()
+            start = time.perf_counter()
+            try:
+                await command.callback(interaction, **kwargs)
+            except Exception as e:
+                errors += 1
+                print(f"  {name} raised {type(e).__name__}: {e}", file=sys.stderr)
+            end = time.perf_counter()
+            latencies.append(end - start)
+            ack_latencies.append((interaction.acknowledged_at or end) - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(make_args(rng)) for _ in range(total)))
+    elapsed = time.perf_counter() - start
+
+    return {'command': name,
+            'requests': total,
+            'errors': errors,
+            'throughput': total / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'ack_p95_ms': percentile(ack_latencies, 95) * 1000,
+            'mal_calls_per_command': (fake.totalCalls() - calls_before) / total}
+
+def printResults(results, baseline=None):
+    baseline = {r['command']: r for r in (baseline or [])}
+    header = f"{'command':<18}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ack p95':>9}{'MAL/cmd':>9}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['command']:<18}{r['throughput']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+              f"{r['p99_ms']:>9.1f}{r['ack_p95_ms']:>9.1f}{r['mal_calls_per_command']:>9.2f}{r['errors']:>8}")
+        old = baseline.get(r['command'])
+        if old is not None:
+            def delta(key):
+                return (r[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            print(f"{'  vs baseline':<18}{delta('throughput'):>+8.0f}%{delta('p50_ms'):>+8.0f}%"
+                  f"{delta('p95_ms'):>+8.0f}%{delta('p99_ms'):>+8.0f}%{delta('ack_p95_ms'):>+8.0f}%"
+                  f"{delta('mal_calls_per_command'):>+8.0f}%")
+
+async def main(args):
+    fake = FakeMAL(anime_count=args.anime, latency=args.latency, jitter=args.jitter,
+                   error_rate=args.error_rate, throttle_rate=args.throttle_rate, seed=args.seed)
+    base_url = await fake.start()
+
+    # The bot reads its settings at import, so point it at the stand-in and
+    # throwaway state files first.
+    state_dir = tempfile.mkdtemp(prefix="malbot-bench-")
+    os.environ.setdefault('GUILD_ID', "0")
+    os.environ['MAL_BASE_URL'] = base_url
+    os.environ['MAL_RATE'] = str(args.rate)
+    os.environ['MAL_BURST'] = str(max(1, int(args.rate)))
+    os.environ['MAL_MAX_CONCURRENT'] = str(args.mal_concurrency)
+    os.environ['MAL_HEDGE_AFTER'] = str(args.hedge_after) if args.hedge_after else ""
+    os.environ['STORE_FILE'] = os.path.join(state_dir, "store.sqlite3")
+    os.environ['CATALOG_FILE'] = os.path.join(state_dir, "catalog.bin")
+    os.environ['LOG_DIR'] = state_dir
+    import discordBot as bot
+
+    random.seed(args.seed)
+    rng = random.Random(args.seed)
+    scenarios = buildScenarios(bot, fake)
+    names = args.commands.split(",") if args.commands else list(scenarios)
+
+    print(f"MAL stand-in at {base_url}, {args.latency * 1000:.0f}ms latency, "
+          f"{args.requests} requests per command at concurrency {args.concurrency}\n")
+    results = []
+    for name in names:
+        results.append(await runScenario(bot, fake, name, scenarios[name], args.requests, args.concurrency, rng))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    printResults(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+    await bot.client.api.close()
+    await bot.client.covers.close()
+    await bot.client.store.close()
+    await fake.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the bot's commands against a local MAL stand-in.")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per command.")
+    parser.add_argument("--concurrency", type=int, default=10, help="Commands in flight at once.")
+    parser.add_argument("--commands", default="", help="Comma separated command names. Default: all.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean MAL latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.02, help="MAL latency standard deviation.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of HTML 500 responses.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of 429 responses.")
+    parser.add_argument("--rate", type=float, default=1000.0, help="Bot-side MAL requests per second.")
+    parser.add_argument("--mal-concurrency", type=int, default=16, help="Bot-side MAL concurrency cap.")
+    parser.add_argument("--hedge-after", type=float, default=0.0, help="Hedge MAL requests slower than this (seconds). Default: off.")
+    parser.add_argument("--anime", type=int, default=5000, help="Anime in the stand-in's catalog.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    parser.add_argument("--compare", help="Compare against results saved with --output.")
+    asyncio.run(main(parser.parse_args()))
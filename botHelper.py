@@ -1,43 +1,34 @@
 # botHelper.py
 # Helper functions for discordBot.py.
-import io
-import aiohttp
+import asyncio
+import discord
+from malApi import PaginationError
 from datetime import timedelta
-from discord import File
-
-# Helper function for downloading images from a given URL.
-async def downloadImage(url, filename="default.jpg"):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                return False
-            data = io.BytesIO(await resp.read())
-            filename = filename.replace(" ", "")
-            image = File(data, filename)
-            return image
-        
+from zoneinfo import ZoneInfo
+
 # Anime info format helper function.
-def formatAnimeInfo(response):
+def formatAnimeInfo(record):
     # There must be a title.
-    anime_title = response['title']
+    anime_title = record.title
 
     # end_date without a start_date shouldn't be possible.
-    if 'start_date' in response and 'end_date' in response:
-        air_date = f"{response['start_date']} ～ {response['end_date']}"
-    elif 'start_date' in response:
-        air_date = f"{response['start_date']} ～ ???"
+    if record.start_date is not None and record.end_date is not None:
+        air_date = f"{record.start_date} ～ {record.end_date}"
+    elif record.start_date is not None:
+        air_date = f"{record.start_date} ～ ???"
     else:
         air_date = "Unknown"
 
     # All season data should exist, or none of it.
-    if 'start_season' in response:
-        air_season = f"{response['start_season']['season'].capitalize()} {response['start_season']['year']}"
+    if record.start_season is not None:
+        season, year = record.start_season
+        air_season = f"{season.capitalize()} {year}"
     else:
         air_season = "Unknown"
 
     # Default value check, just in case.
-    num_episodes = response.get('num_episodes', 'Unknown')
-    rating = response.get('mean', 'Unknown')
+    num_episodes = record.num_episodes if record.num_episodes is not None else 'Unknown'
+    rating = record.mean if record.mean is not None else 'Unknown'
 
     anime_info = [f"Title: {anime_title}\n",
                   f"Episodes: {num_episodes}\n",
@@ -47,11 +38,100 @@ def formatAnimeInfo(response):
     anime_info = ''.join(anime_info)
     return anime_info
 
-# Takes datetime and day of the week string and returns datetime that
-# corresponds to next occurance of that day. If the day of the week
-# given is the same as "today", then it returns "today".
-def nextDay(today, day):
-    day_str = {'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
-               'friday': 4, 'saturday': 5, 'sunday': 6}
-    days = (day_str[day] - today.weekday()) % 7
-    return today + timedelta(days=days)
\ No newline at end of file
+# MAL broadcast times are given in JST.
+JST = ZoneInfo("Asia/Tokyo")
+WEEKDAYS = {'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
+            'friday': 4, 'saturday': 5, 'sunday': 6}
+
+# Takes an aware datetime, a day of the week and an "HH:MM" JST start time
+# and returns the next broadcast as an aware JST datetime. A broadcast
+# that started earlier today counts as next week's. Missing start times
+# are treated as midnight.
+def nextBroadcast(now, day, start_time=None):
+    hour, minute = 0, 0
+    if start_time:
+        hour, minute = (int(part) for part in start_time.split(":")[:2])
+    now = now.astimezone(JST)
+    days = (WEEKDAYS[day] - now.weekday()) % 7
+    air = (now + timedelta(days=days)).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if air <= now:
+        air += timedelta(days=7)
+    return air
+
+# Formats a timedelta as "2d 3h 15m".
+def formatDuration(delta):
+    minutes = int(delta.total_seconds() // 60)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days}d {hours}h {minutes}m"
+    if hours:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m"
+
+# Message view that pages through an async iterator of entries.
+# Entries are only pulled (and so only fetched from MAL) when a page is opened.
+class PagedView(discord.ui.View):
+    def __init__(self, entries, render, page_size=10, timeout=180):
+        super().__init__(timeout=timeout)
+        self.entries = entries      # Async iterator of entries.
+        self.render = render        # render(items, start_index) -> str or discord.Embed
+        self.page_size = page_size
+        self.buffer = []
+        self.exhausted = False
+        self.page = 0
+        self.message = None
+        self._lock = asyncio.Lock()  # One fetch at a time per view.
+
+    # Renders the current page. Returns None if it has no entries.
+    async def renderPage(self):
+        start = self.page * self.page_size
+        async with self._lock:
+            # One extra entry tells us whether there's a next page.
+            await self._fill(start + self.page_size + 1)
+        items = self.buffer[start:start + self.page_size]
+        if len(items) == 0:
+            return None
+        self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = len(self.buffer) <= start + self.page_size
+        return self.render(items, start)
+
+    async def _fill(self, count):
+        while not self.exhausted and len(self.buffer) < count:
+            try:
+                self.buffer.append(await self.entries.__anext__())
+            except (StopAsyncIteration, PaginationError):
+                # A failed page just ends the view where it is.
+                self.exhausted = True
+
+    async def _turn(self, interaction, step):
+        await interaction.response.defer()
+        self.page += step
+        content = await self.renderPage()
+        if content is None:
+            self.page -= step
+            return
+        if isinstance(content, discord.Embed):
+            await interaction.edit_original_response(embed=content, view=self)
+        else:
+            await interaction.edit_original_response(content=content, view=self)
+
+    @discord.ui.button(label="Prev", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction, button):
+        await self._turn(interaction, -1)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        await self._turn(interaction, 1)
+
+    # Disable the buttons once nobody can use them anymore.
+    async def on_timeout(self):
+        if hasattr(self.entries, "aclose"):
+            await self.entries.aclose()
+        if self.message is not None:
+            for item in self.children:
+                item.disabled = True
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
@@ -0,0 +1,125 @@
+# broadcastSchedule.py
+# In-memory schedule of currently airing shows, ordered by next broadcast.
+import asyncio
+import heapq
+from datetime import date, datetime, timedelta, timezone
+from malApi import PaginationError
+from requestScheduler import BACKGROUND, setPriority
+import botHelper
+
+WEEK = 7 * 24 * 3600
+
+# Returns the season name and year a date falls in.
+def seasonOf(day):
+    return ["winter", "spring", "summer", "fall"][(day.month - 1) // 3], day.year
+
+class BroadcastSchedule:
+
+    def __init__(self):
+        # id -> (title, day_of_the_week, start_time or None, next timestamp)
+        self.shows = {}
+        # Heap of (next timestamp, id). Entries whose timestamp no longer
+        # matches self.shows are stale and skipped.
+        self._heap = []
+        self.built_at = None
+
+    def __len__(self):
+        return len(self.shows)
+
+    # Adds airing shows with a known broadcast slot, drops ones that have
+    # stopped airing. Records without a status leave the schedule alone.
+    def addRecords(self, records, now=None):
+        now = now or datetime.now(timezone.utc)
+        for record in records:
+            anime_id = record.id
+            status = record.status
+            if status is None:
+                continue
+            if status != "currently_airing":
+                self.shows.pop(anime_id, None)
+                continue
+            day, start_time = record.broadcast
+            if day not in botHelper.WEEKDAYS:
+                continue
+            next_air = botHelper.nextBroadcast(now, day, start_time)
+            timestamp = next_air.timestamp()
+            old = self.shows.get(anime_id)
+            self.shows[anime_id] = (record.title or str(anime_id), day, start_time, timestamp)
+            if old is not None and old[3] == timestamp:
+                continue  # Already queued for this slot.
+            heapq.heappush(self._heap, (timestamp, anime_id))
+
+    # Pops broadcasts that have passed and pushes their next week's slot.
+    def _advance(self, now_ts):
+        while self._heap and self._heap[0][0] <= now_ts:
+            timestamp, anime_id = heapq.heappop(self._heap)
+            show = self.shows.get(anime_id)
+            if show is None or show[3] != timestamp:
+                continue  # Stale entry.
+            while timestamp <= now_ts:
+                timestamp += WEEK
+            self.shows[anime_id] = show[:3] + (timestamp,)
+            heapq.heappush(self._heap, (timestamp, anime_id))
+
+    # Returns (title, day, start_time, next air datetime in UTC) or None.
+    def nextAiring(self, anime_id, now=None):
+        now = now or datetime.now(timezone.utc)
+        self._advance(now.timestamp())
+        show = self.shows.get(int(anime_id))
+        if show is None:
+            return None
+        title, day, start_time, timestamp = show
+        return title, day, start_time, datetime.fromtimestamp(timestamp, timezone.utc)
+
+    # Returns [(air datetime in UTC, id, title)] for broadcasts in
+    # [start, end), soonest first. Defaults to the next 24 hours. Windows
+    # starting in the past also include last week's slot, so a "today"
+    # view still lists shows that already aired today.
+    def upcoming(self, start=None, end=None):
+        now = datetime.now(timezone.utc)
+        self._advance(now.timestamp())
+        start = start or now
+        end = end or start + timedelta(days=1)
+        start_ts, end_ts = start.timestamp(), end.timestamp()
+        results = []
+        for timestamp, anime_id in sorted(self._heap):
+            if timestamp >= end_ts + WEEK:
+                break
+            show = self.shows.get(anime_id)
+            if show is None or show[3] != timestamp:
+                continue
+            for air_ts in (timestamp - WEEK, timestamp):
+                if start_ts <= air_ts < end_ts:
+                    results.append((datetime.fromtimestamp(air_ts, timezone.utc), anime_id, show[0]))
+        results.sort()
+        return results
+
+    # Refreshes from this season and last. Shows learned from other lookups
+    # (like long-running ones from older seasons) are kept unless their
+    # status changed. Nothing is changed unless both seasons were read to
+    # the end.
+    async def rebuild(self, api):
+        today = date.today()
+        seasons = [seasonOf(today), seasonOf(today - timedelta(days=92))]
+        records = []
+        try:
+            for season, year in seasons:
+                async for anime in api.iterSeasonalAnime(year, season, page_size=100, prefetch=0):
+                    records.append(anime)
+        except PaginationError:
+            return False
+        if len(records) == 0:
+            return False  # Keep the old schedule if MAL is unreachable.
+        self.addRecords(records)
+        # Drop heap entries left behind by shows that moved or were removed.
+        self._heap = [(show[3], anime_id) for anime_id, show in self.shows.items()]
+        heapq.heapify(self._heap)
+        self.built_at = datetime.now(timezone.utc)
+        return True
+
+    # Background task: rebuilds the schedule periodically.
+    async def refreshLoop(self, api, interval=6 * 3600):
+        setPriority(BACKGROUND)
+        while True:
+            await self.rebuild(api)
+            await asyncio.sleep(interval)
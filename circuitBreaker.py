@@ -0,0 +1,69 @@
+# circuitBreaker.py
+# Circuit breaker for MAL requests. After enough consecutive failures the
+# circuit opens and requests fail at once instead of waiting on a dead
+# server; after a cool-off one probe is let through to test the waters.
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+
+        # Counters.
+        self.opened = 0
+        self.rejected = 0
+
+    # True if a request may go out now.
+    def allow(self):
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() >= self._opened_at + self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probing = False
+        # A probe that never reported back is given up on after a while.
+        if self.state == HALF_OPEN and (not self._probing
+                                        or time.monotonic() >= self._probe_started + self.reset_timeout):
+            self._probing = True
+            self._probe_started = time.monotonic()
+            return True
+        self.rejected += 1
+        return False
+
+    # The probe never reached MAL (cancelled, or its deadline passed while
+    # queued). Says nothing about MAL, but lets another request probe.
+    def release(self):
+        if self.state == HALF_OPEN:
+            self._probing = False
+
+    # MAL answered (even with a client error), so it's up.
+    def recordSuccess(self):
+        self.state = CLOSED
+        self._failures = 0
+        self._probing = False
+
+    # A timeout, connection error or 5xx.
+    def recordFailure(self):
+        self._failures += 1
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.opened += 1
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+    def stats(self):
+        return {'state': self.state,
+                'open': int(self.state != CLOSED),
+                'failures': self._failures,
+                'opened': self.opened,
+                'rejected': self.rejected}
@@ -0,0 +1,108 @@
+# commandRunner.py
+# Shared wrapper for slash command handlers. Discord drops an interaction
+# that isn't acknowledged within 3 seconds, so the runner defers for the
+# handler: up front when the command is predicted to be slow, or from a
+# watchdog once the elapsed time nears the budget. Fast commands (usually
+# ones answered from cache) reply directly with no defer round trip.
+# Handlers reply with interaction.send(), which goes through the initial
+# response or a followup as appropriate.
+import asyncio
+import functools
+import metrics
+import time
+from collections import deque
+
+# Stands in for the interaction inside a handler.
+class Reply:
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.deferred = False
+        self.replied_at = None
+        # Keeps the watchdog's defer and the handler's reply from racing.
+        self._lock = asyncio.Lock()
+
+    # Everything else (user, guild, extras, ...) comes from the interaction.
+    def __getattr__(self, name):
+        return getattr(self.interaction, name)
+
+    # Acknowledges the interaction if nothing has been sent yet.
+    async def defer(self, **kwargs):
+        async with self._lock:
+            if not self.interaction.response.is_done():
+                await self.interaction.response.defer(**kwargs)
+                self.deferred = True
+
+    # Sends a reply through the initial response if it's still open,
+    # otherwise as a followup. Returns the message when a view is
+    # attached (views edit their message on timeout), else None.
+    async def send(self, content=None, **kwargs):
+        async with self._lock:
+            if self.replied_at is None:
+                self.replied_at = time.perf_counter()
+            if not self.interaction.response.is_done():
+                await self.interaction.response.send_message(content, **kwargs)
+                if 'view' in kwargs:
+                    return await self.interaction.original_response()
+                return None
+            message = await self.interaction.followup.send(content, wait='view' in kwargs, **kwargs)
+            return message if 'view' in kwargs else None
+
+class CommandRunner:
+
+    def __init__(self, budget=3.0, margin=1.0, samples=50, min_samples=5):
+        # Defer once this much of Discord's budget has been used.
+        self.defer_at = budget - margin
+        # Recent handler times by command, newest last.
+        self.samples = samples
+        self.min_samples = min_samples
+        self._latency = {}
+
+    # Decorator for handlers. backend is the MAL endpoint label the
+    # command mostly waits on, used for predictions until the command has
+    # enough history of its own.
+    def command(self, backend=None):
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(interaction, *args, **kwargs):
+                return await self.run(func, backend, interaction, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Predicted handler time in seconds: the 90th percentile of recent
+    # runs, or of the backend's MAL latency before there are enough runs.
+    def predict(self, name, backend=None):
+        history = self._latency.get(name)
+        if history is not None and len(history) >= self.min_samples:
+            ordered = sorted(history)
+            return ordered[int(0.9 * (len(ordered) - 1))]
+        if backend is not None:
+            return metrics.mal_latency.quantile(0.9, endpoint=backend) or 0.0
+        return 0.0
+
+    async def run(self, func, backend, interaction, *args, **kwargs):
+        name = func.__name__
+        reply = Reply(interaction)
+        started = interaction.extras.get('started') or time.perf_counter()
+        watchdog = None
+        if self.predict(name, backend) >= self.defer_at - (time.perf_counter() - started):
+            metrics.command_defers.inc(command=name, reason="predicted")
+            await reply.defer()
+        else:
+            watchdog = asyncio.ensure_future(self._watchdog(reply, name, started))
+
+        run_started = time.perf_counter()
+        try:
+            return await func(reply, *args, **kwargs)
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            history = self._latency.setdefault(name, deque(maxlen=self.samples))
+            history.append((reply.replied_at or time.perf_counter()) - run_started)
+
+    # Defers when the budget is nearly used up and nothing has been sent.
+    async def _watchdog(self, reply, name, started):
+        await asyncio.sleep(max(self.defer_at - (time.perf_counter() - started), 0.0))
+        if reply.replied_at is None:
+            metrics.command_defers.inc(command=name, reason="watchdog")
+            await asyncio.shield(reply.defer())
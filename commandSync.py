@@ -0,0 +1,32 @@
+# commandSync.py
+# Syncing the command tree is a rate-limited Discord round trip, and on
+# most restarts nothing about the commands has changed. The tree's payload
+# is hashed and the hash kept in the store; sync only runs when it differs.
+import discord
+import hashlib
+import json
+
+# A command's payload. discord.py 2.4 added the tree argument to to_dict;
+# the 2.3 line in requirements.txt takes none.
+def _commandPayload(command, tree):
+    if discord.version_info >= (2, 4):
+        return command.to_dict(tree)
+    return command.to_dict()
+
+# Hash of the command payloads Discord would be sent for a guild (or the
+# global commands when guild is None).
+def treeFingerprint(tree, guild=None):
+    payload = sorted((_commandPayload(command, tree) for command in tree.get_commands(guild=guild)),
+                     key=lambda command: (command['name'], command.get('type', 1)))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+# Syncs the tree if its commands changed since the last sync. Returns
+# True if a sync was sent.
+async def syncIfChanged(tree, store, guild=None, application_id=None):
+    key = f"command_tree:{application_id}:{guild.id if guild is not None else 'global'}"
+    fingerprint = treeFingerprint(tree, guild)
+    if store.getMeta(key) == fingerprint:
+        return False
+    await tree.sync(guild=guild)
+    store.setMeta(key, fingerprint)
+    return True
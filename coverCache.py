@@ -0,0 +1,150 @@
+# coverCache.py
+# Cover image downloads with a shared session and a bounded LRU cache.
+import aiohttp
+import asyncio
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from discord import File
+
+class CoverCache:
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, disk_dir=None, total_timeout=10):
+        # Memory cache: url -> bytes, least recently used first.
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._size = 0
+
+        # Optional on-disk cache, keyed by a hash of the URL.
+        self.disk_dir = disk_dir
+        if self.disk_dir is not None:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+        # Downloads already running, so concurrent requests share one fetch.
+        self._pending = {}
+
+        # Session is created lazily inside the event loop.
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout)
+        self._session = None
+
+        # Counters.
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # Returns a new discord.File for the image at url, False on fail.
+    async def getImage(self, url, filename="default.jpg"):
+        data = await self.getBytes(url)
+        if data == False:
+            return False
+        filename = filename.replace(" ", "")
+        return File(io.BytesIO(data), filename)
+
+    # True if the cover is in memory.
+    def has(self, url):
+        return url in self._images
+
+    # Returns the raw image bytes for url, False on fail.
+    async def getBytes(self, url):
+        # Some entries have no cover.
+        if not url:
+            return False
+
+        # Memory hit.
+        if url in self._images:
+            self._images.move_to_end(url)
+            self.hits += 1
+            return self._images[url]
+
+        # Share one fetch between concurrent requests for the same cover.
+        if url not in self._pending:
+            self._pending[url] = asyncio.ensure_future(self._load(url))
+        return await asyncio.shield(self._pending[url])
+
+    # Reads from disk or downloads, then stores in memory.
+    async def _load(self, url):
+        try:
+            data = False
+            if self.disk_dir is not None:
+                data = await asyncio.to_thread(self._readDisk, url)
+                if data != False:
+                    self.disk_hits += 1
+
+            if data == False:
+                self.misses += 1
+                data = await self._download(url)
+                if data == False:
+                    return False
+                if self.disk_dir is not None:
+                    await asyncio.to_thread(self._writeDisk, url, data)
+
+            self._store(url, data)
+            return data
+        finally:
+            self._pending.pop(url, None)
+
+    # Downloads the image, False on fail.
+    async def _download(self, url):
+        session = self._getSession()
+        try:
+            async with session.get(url) as resp:
+                if resp.status != 200:
+                    return False
+                return await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    # Inserts into the memory cache, evicting the oldest images over the cap.
+    def _store(self, url, data):
+        if len(data) > self.max_bytes:
+            return
+        if url in self._images:
+            self._size -= len(self._images.pop(url))
+        self._images[url] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._images.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _diskPath(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.disk_dir, key)
+
+    def _readDisk(self, url):
+        try:
+            with open(self._diskPath(url), "rb") as f:
+                return f.read()
+        except OSError:
+            return False
+
+    # Writes to a temp file first so a crash never leaves half an image.
+    def _writeDisk(self, url, data):
+        path = self._diskPath(url)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    def _getSession(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        return self._session
+
+    # Hit/miss counters and memory usage.
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'entries': len(self._images),
+                'bytes': self._size}
+
+    # Closes the shared session. Call on shutdown.
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
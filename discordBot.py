@@ -1,89 +1,318 @@
 # discordBot.py
+import asyncio
 import discord
 import os
 import random
 import botHelper # Helper functions.
+import messageRenderer
+import metrics
+import time
 from dotenv import load_dotenv
 from enum import Enum
-from datetime import date
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
 from discord import app_commands
+from animeCatalog import AnimeCatalog
+from animeRecord import AnimeRecord
+from broadcastSchedule import BroadcastSchedule
+from commandRunner import CommandRunner
+from commandSync import syncIfChanged
+from coverCache import CoverCache
+from listAnalysis import ListAnalyzer
+from listWatcher import ListWatcher
+from messageRenderer import RenderCache
 from malApi import malAPI
+from metadataStore import MetadataStore
+from prefetcher import Prefetcher
+from searchIndex import SearchIndex
+from sharedRateLimit import SharedTokenBucket
 
 # Load tokens.
 load_dotenv()
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
+# Commands are registered globally unless GUILD_ID names a test guild.
 GUILD_ID = os.getenv('GUILD_ID')
-MY_GUILD = discord.Object(id=GUILD_ID)
+MY_GUILD = discord.Object(id=GUILD_ID) if GUILD_ID else None
+# Sharding. With neither set, one process runs every shard Discord asks for.
+# To split shards across processes, give each the same SHARD_COUNT and its
+# own SHARD_IDS (e.g. "0,1"); they share the STORE_FILE.
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+SHARD_IDS = [int(i) for i in os.getenv('SHARD_IDS').split(',')] if os.getenv('SHARD_IDS') else None
+TIMEZONES = sorted(available_timezones())
+
+# Command tree that times every command for the metrics.
+class MyTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction):
+        interaction.extras['started'] = time.perf_counter()
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        name = interaction.command.name if interaction.command else "unknown"
+        metrics.command_errors.inc(command=name)
+        recordCommandTime(interaction, name)
+        await super().on_error(interaction, error)
+
+# Records how long a command took, from tree dispatch to return.
+def recordCommandTime(interaction, name):
+    started = interaction.extras.get('started')
+    if started is not None:
+        metrics.command_latency.observe(time.perf_counter() - started, command=name)
 
 # Client wrapper to bind commands and guild_id.
-class MyClient(discord.Client):
+class MyClient(discord.AutoShardedClient):
     def __init__(self, *, intents: discord.Intents):
-        super().__init__(intents=intents)
+        # Seconds spent in each startup phase, logged once warm.
+        self.startup_times = {}
+        self._phase_started = time.perf_counter()
+
+        super().__init__(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+
+        # One process per deployment syncs commands and runs the crawlers
+        # whose results every process shares through the store.
+        self.primary = SHARD_IDS is None or 0 in SHARD_IDS
 
         # Bind tree to client.
-        self.tree = app_commands.CommandTree(self)
+        self.tree = MyTree(self)
 
-        # API connection.
-        self.api = malAPI()
-    
-    # Sync commands to one guild.
+        # Persistent anime records and response snapshots.
+        store_file = os.getenv('STORE_FILE', 'mal_store.sqlite3')
+        self.store = MetadataStore(store_file)
+
+        # Shard processes on one machine share a MAL rate limit through a
+        # small SQLite file of its own, so more shards don't mean more MAL
+        # traffic. It's kept apart from the store so it never waits on a flush.
+        rate = float(os.getenv('MAL_RATE', 2.0))
+        burst = int(os.getenv('MAL_BURST', 5))
+        self.rate_bucket = None
+        if SHARD_IDS is not None or os.getenv('SHARED_RATE_LIMIT') == '1':
+            self.rate_bucket = SharedTokenBucket(os.getenv('RATE_LIMIT_FILE', 'mal_rate_limit.sqlite3'), rate, burst)
+
+        # API connection. Pool size, timeout and rate limits are tunable from .env.
+        self.api = malAPI(store=self.store,
+                          base_url=os.getenv('MAL_BASE_URL', "https://api.myanimelist.net/v2"),
+                          connection_limit=int(os.getenv('MAL_CONNECTION_LIMIT', 20)),
+                          total_timeout=float(os.getenv('MAL_TIMEOUT', 10)),
+                          rate=rate,
+                          burst=burst,
+                          rate_bucket=self.rate_bucket,
+                          max_concurrent=int(os.getenv('MAL_MAX_CONCURRENT', 4)),
+                          log_dir=os.getenv('LOG_DIR', '.'),
+                          log_requests=os.getenv('LOG_REQUESTS', '') == '1',
+                          deadline=float(os.getenv('MAL_DEADLINE', 15)),
+                          retries=int(os.getenv('MAL_RETRIES', 2)),
+                          hedge_after=float(os.getenv('MAL_HEDGE_AFTER')) if os.getenv('MAL_HEDGE_AFTER') else None)
+
+        # Cover images. Disk cache is optional.
+        self.covers = CoverCache(max_bytes=int(os.getenv('COVER_CACHE_MB', 32)) * 1024 * 1024,
+                                 disk_dir=os.getenv('COVER_CACHE_DIR') or None)
+
+        self.api.addListener(self.store.addRecords, stored=False)
+
+        # Warms details and covers of the top listed results in the background.
+        self.prefetch = Prefetcher(self.api, self.covers,
+                                   top_n=int(os.getenv('PREFETCH_TOP_N', 5)),
+                                   per_minute=int(os.getenv('PREFETCH_PER_MINUTE', 20)))
+
+        # Known-valid anime IDs, fed by every response the API sees.
+        self.catalog = AnimeCatalog(os.getenv('CATALOG_FILE', 'anime_catalog.bin'))
+        self.api.addListener(self.catalog.addRecords)
+
+        # Local title index for search and autocomplete.
+        self.search = SearchIndex()
+        self.api.addListener(self.search.addRecords)
+
+        # Next broadcast of every airing show.
+        self.schedule = BroadcastSchedule()
+        self.api.addListener(self.schedule.addRecords)
+
+        # Packed user lists for /compare and /guildrecommend.
+        self.lists = ListAnalyzer(self.api, ttl=int(os.getenv('USER_LIST_TTL', 1800)))
+
+        # Posts linked members' list updates to each guild's watch channel.
+        self.watcher = ListWatcher(self.api, self.store, self.postListUpdates,
+                                   min_interval=int(os.getenv('WATCH_MIN_INTERVAL', 600)),
+                                   max_interval=int(os.getenv('WATCH_MAX_INTERVAL', 6 * 3600)),
+                                   owns=self.ownsGuild)
+
+        # Rendered list replies, reused until their data is refreshed.
+        self.renders = RenderCache(max_entries=int(os.getenv('RENDER_CACHE_ENTRIES', 512)))
+
+        # Cache hit ratios and sizes for the metrics.
+        metrics.addStatsGauge("cache_stats", "Cache counters and hit ratios.",
+                              {'response': self.api.cache, 'covers': self.covers, 'user_lists': self.lists,
+                               'prefetch': self.prefetch, 'renders': self.renders})
+        metrics.REGISTRY.gauge("mal_circuit_open", "1 while the MAL circuit breaker is open or probing.",
+                               lambda: {(): self.api.breaker.stats()['open']})
+
+        # Long-running background tasks, cancelled on shutdown.
+        self.background_tasks = []
+        self.metrics_server = None
+        self.markPhase("init")
+
+    # Records the time since the last phase ended under this one.
+    def markPhase(self, phase):
+        now = time.perf_counter()
+        self.startup_times[phase] = now - self._phase_started
+        self._phase_started = now
+
+    # Sync commands if they changed and start the light background work.
+    # Stored data is loaded after login, in warmUp.
     async def setup_hook(self):
-        self.tree.copy_global_to(guild=MY_GUILD)
-        await self.tree.sync(guild=MY_GUILD)
+        if self.primary:
+            if MY_GUILD is not None:
+                self.tree.copy_global_to(guild=MY_GUILD)
+            synced = await syncIfChanged(self.tree, self.store, MY_GUILD, self.application_id)
+            print("Command tree changed, synced." if synced else "Command tree unchanged, sync skipped.")
+        self.background_tasks.append(asyncio.create_task(self.store.flushLoop()))
+        self.background_tasks.append(asyncio.create_task(metrics.loopLagMonitor()))
+        self.background_tasks.append(asyncio.create_task(self.prefetch.prefetchLoop()))
+
+        # Optional local Prometheus endpoint.
+        if os.getenv('METRICS_PORT'):
+            self.metrics_server = await metrics.startServer(int(os.getenv('METRICS_PORT')))
+        self.markPhase("setup")
+
+    # Loads the stored working set into the caches and indexes, then
+    # starts the crawlers that depend on them. Commands are answered in
+    # the meantime, just with colder caches.
+    async def warmUp(self):
+        anime_count, snapshot_count = await self.api.warmStart(max_anime=int(os.getenv('WARM_START_ANIME', 20000)))
+        self.markPhase("warm_start")
+        if self.primary:
+            self.background_tasks.append(asyncio.create_task(self.catalog.growLoop(self.api)))
+            self.background_tasks.append(asyncio.create_task(self.store.syncLoop(self.api)))
+        self.background_tasks.append(asyncio.create_task(self.schedule.refreshLoop(self.api)))
+        self.background_tasks.append(asyncio.create_task(self.watcher.watchLoop()))
+        print(f"Warm start: {anime_count} anime, {snapshot_count} cached responses.")
+        print("Startup: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.startup_times.items())
+              + f", total {sum(self.startup_times.values()):.2f}s")
+
+    # True if the guild is on one of this process's shards.
+    def ownsGuild(self, guild_id):
+        if SHARD_IDS is None:
+            return True
+        return (guild_id >> 22) % SHARD_COUNT in SHARD_IDS
+
+    # Sends a user's new list updates to their guilds' watch channels.
+    async def postListUpdates(self, mal_name, channel_ids, records):
+        results = f"{mal_name} updated their list:\n"
+        for record in records[-10:]:
+            status = (record.list_status or "unknown").replace("_", " ").capitalize()
+            score = f", scored {record.list_score}" if record.list_score else ""
+            results += f"   {record.title} (ID: {record.id}): {status}{score}\n"
+        if len(records) > 10:
+            results += f"   ...and {len(records) - 10} more.\n"
+        for channel_id in channel_ids:
+            channel = self.get_channel(channel_id)
+            if channel is None:
+                continue
+            try:
+                await channel.send(results[:2000])
+            except discord.HTTPException:
+                pass
 
     # Shutdown command.
     async def close(self):
         print("Shutting down.")
+        for task in self.background_tasks:
+            task.cancel()
+        if self.primary:
+            self.catalog.save()
+        if self.metrics_server is not None:
+            await self.metrics_server.cleanup()
+        await self.store.close()
+        await self.api.close()
+        if self.rate_bucket is not None:
+            self.rate_bucket.close()
+        await self.covers.close()
         await super().close()
 
 # Client definition and setup.
 intents = discord.Intents.default()
 client = MyClient(intents=intents)
 
+# Every command runs through this, so slow ones get deferred in time.
+runner = CommandRunner()
+
 # Log-in message.
 @client.event
 async def on_ready():
     print(f'Logged in as {client.user} (ID: {client.user.id})')
     print('------')
+    # on_ready fires again after reconnects; only warm up once.
+    if "ready" not in client.startup_times:
+        client.markPhase("ready")
+        client.background_tasks.append(asyncio.create_task(client.warmUp()))
+
+# Command timing for the metrics.
+@client.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    recordCommandTime(interaction, command.name)
+
+# Autocomplete for anime names, answered from the local title index.
+async def animeNameAutocomplete(interaction: discord.Interaction, current: str):
+    matches = client.search.search(current, 25)
+    return [app_commands.Choice(name=title[:100], value=title[:100]) for _, _, title in matches]
+
+# Autocomplete for anime ids. Shows titles, fills in the id.
+async def animeIdAutocomplete(interaction: discord.Interaction, current: str):
+    matches = client.search.search(current, 25)
+    return [app_commands.Choice(name=f"{title} (ID: {anime_id})"[:100], value=str(anime_id))
+            for _, anime_id, title in matches]
 
 # Search for an anime.
 @client.tree.command(name="animebyname", description="Returns a list of anime that match the search query. Use /animebyid for details.")
 @app_commands.describe(query="Name of anime.", limit="Number of results to return. Default: 10, Limit: 20")
+@app_commands.autocomplete(query=animeNameAutocomplete)
+@runner.command(backend="/v2/anime")
 async def animeByName(interaction: discord.Interaction, query: str, limit: int=10):
-    response = client.api.getAnime(query.strip(), limit)
-    if response == False:
-        await interaction.response.send_message(f"Request send error.")
-        return
+    limit = min(max(limit, 1), client.api.limit_cap)
 
-    # Format response.
-    results = ""
-    i = 1
-    for item in response:
-        results += f"#{i} {item['title']} (ID: {item['id']})\n"
-        i += 1
-    await interaction.response.send_message(results)
+    # Reuse the last reply until this search's cached response is refreshed.
+    request = client.api.searchRequest(query.strip(), limit)
+    rendered = client.renders.get("animebyname", (query, limit), client.api.dataVersion(*request))
+    if rendered is None:
+        # Only go to MAL when the local index doesn't have enough good matches.
+        matches = client.search.search(query, limit, min_score=0.75)
+        if len(matches) >= limit:
+            response = [AnimeRecord(anime_id, title) for _, anime_id, title in matches]
+        else:
+            response = await client.api.getAnime(query.strip(), limit)
+        if response == False:
+            await interaction.send(f"Request send error.")
+            return
+
+        # Format response.
+        lines = [f"#{i} {item.title} (ID: {item.id})" for i, item in enumerate(response, 1)]
+        rendered = (messageRenderer.listEmbeds(f"Results for {query.strip()}:", lines), [item.id for item in response])
+        client.renders.put("animebyname", (query, limit), client.api.dataVersion(*request),
+                           rendered, client.api.cache_ttls['search'])
+
+    pages, anime_ids = rendered
+    await messageRenderer.sendPages(interaction, pages)
+    client.prefetch.queue(anime_ids)
 
 # Retrieve anime by ID.
 @client.tree.command(name="animebyid", description="Retrieves the MAL entry for the anime id given.")
 @app_commands.describe(anime_id="MAL anime id.")
+@app_commands.autocomplete(anime_id=animeIdAutocomplete)
+@runner.command(backend="/v2/anime/{id}")
 async def animeById(interaction: discord.Interaction, anime_id: str):
-    # Prevent timeout.
-    await interaction.response.defer()
-
     # Call API.
-    response = client.api.getAnimeByID(anime_id.strip())
+    client.prefetch.recordLookup(anime_id.strip())
+    response = await client.api.getAnimeByID(anime_id.strip())
     if response == False:
-        await interaction.followup.send(f"The requested anime could not be found.")
+        await interaction.send(f"The requested anime could not be found.")
         return
     
     # Format response, retrieve cover, send.
     anime_info = botHelper.formatAnimeInfo(response)
-    picture_url = response['main_picture']['medium']
-    anime_pic = await botHelper.downloadImage(picture_url, f"{response['title']}.jpg")
+    picture_url = response.picture
+    anime_pic = await client.covers.getImage(picture_url, f"{response.title}.jpg")
     if anime_pic == False:
-        await interaction.followup.send(f"Error: Failed to retrieve image for {response['title']}.")
+        await interaction.send(f"Error: Failed to retrieve image for {response.title}.")
     else:
-        await interaction.followup.send(file=anime_pic, content=anime_info)
+        await interaction.send(file=anime_pic, content=anime_info)
 
 # Enum to enable slash command choices.
 class Rankings(Enum):
@@ -110,17 +339,28 @@ rank_explanations = { "all" : "Top Anime Series:",
 # Retrieve anime by ranking.
 @client.tree.command(name="animeranking", description="Retrieves anime ranking by given type.")
 @app_commands.describe(rank_type="Ranking type.", limit="Number of results to return. Default: 10, Limit: 20")
+@runner.command(backend="/v2/anime/ranking")
 async def animeRanking(interaction: discord.Interaction, rank_type: Rankings, limit: int=10):
-    response = client.api.getAnimeRanking(rank_type.value, limit)
-    if response == False:
-        await interaction.response.send_message(f"Request send error.")
-        return
-    
-    # Format response.
-    results = rank_explanations[rank_type.value] + "\n" # Header.
-    for item in response:
-        results += f"#{item['rank']} {item['title']} (ID: {item['id']})\n"
-    await interaction.response.send_message(results)
+    limit = min(max(limit, 1), client.api.limit_cap)
+
+    # Reuse the last reply until this ranking's cached response is refreshed.
+    request = client.api.rankingRequest(rank_type.value, limit)
+    rendered = client.renders.get("animeranking", (rank_type.value, limit), client.api.dataVersion(*request))
+    if rendered is None:
+        response = await client.api.getAnimeRanking(rank_type.value, limit)
+        if response == False:
+            await interaction.send(f"Request send error.")
+            return
+
+        # Format response.
+        lines = [f"#{item.rank} {item.title} (ID: {item.id})" for item in response]
+        rendered = (messageRenderer.listEmbeds(rank_explanations[rank_type.value], lines), [item.id for item in response])
+        ttl = client.api.cache_ttls['ranking_airing' if rank_type.value == "airing" else 'ranking']
+        client.renders.put("animeranking", (rank_type.value, limit), client.api.dataVersion(*request), rendered, ttl)
+
+    pages, anime_ids = rendered
+    await messageRenderer.sendPages(interaction, pages)
+    client.prefetch.queue(anime_ids)
 
 # Enum to enable slash command choices.
 class SeasonSort(Enum):
@@ -135,93 +375,176 @@ class Seasons(Enum):
 
 # Retrieve seasonal anime.
 @client.tree.command(name="animebyseason", description="Retrieves all anime from a given season.")
-@app_commands.describe(season="Airing season.", year="Airing year.", sort="Sort order.", limit="Number of results to return. Default: 10, Limit: 20")
+@app_commands.describe(season="Airing season.", year="Airing year.", sort="Sort order.", limit="Results per page. Default: 10, Limit: 20")
+@runner.command(backend="/v2/anime/season")
 async def animeBySeason(interaction: discord.Interaction, season: Seasons, year: int, sort: SeasonSort, limit: int=10):
-    response = client.api.getSeasonalAnime(year, season.value, sort.value, limit)
-    if response == False:
-        await interaction.response.send_message(f"Request send error.")
+    limit = min(max(limit, 1), client.api.limit_cap)
+
+    # Format a page. Whatever page is shown gets its top entries prefetched.
+    def render(items, start):
+        client.prefetch.queue(item.id for item in items)
+        lines = [f"#{i} {item.title} (ID: {item.id})" for i, item in enumerate(items, start + 1)]
+        return messageRenderer.listEmbeds(f"{season.value.capitalize()} {year}:", lines,
+                                          footer=f"Page {start // limit + 1}")[0]
+
+    # Pages are fetched from MAL only as they're opened.
+    entries = client.api.iterSeasonalAnime(year, season.value, sort.value, page_size=limit * 5, prefetch=0)
+    view = botHelper.PagedView(entries, render, limit)
+    results = await view.renderPage()
+    if results is None:
+        await interaction.send(f"Request send error.")
         return
-    
-    # Format response.
-    results = f"{season.value.capitalize()} {str(year)}:\n" # Header
-    i = 1
-    for item in response:
-        results += f"#{i} {item['title']} (ID: {item['id']})\n"
-        i += 1
-    await interaction.response.send_message(results)
+    view.message = await interaction.send(embed=results, view=view)
 
 # Get random anime.
 @client.tree.command(name="randomanime", description="Get a random anime.")
-async def randomAnime(interaction: discord.Interaction):
-    # Prevent timeout.
-    await interaction.response.defer()
-
-    # Generate random id.
+@app_commands.describe(airing="Only currently airing anime.", min_score="Minimum MAL score.", season="Airing season.", year="Airing year.")
+@runner.command(backend="/v2/anime/{id}")
+async def randomAnime(interaction: discord.Interaction, airing: bool=False, min_score: float=0.0, season: Seasons=None, year: int=None):
+    # Pick from the catalog of known IDs. Retries only cover IDs that have
+    # since been removed from MAL, or blind guesses while the catalog is empty.
+    # Any other failure means MAL is having trouble, so stop there.
+    season_value = season.value if season is not None else None
+    filtered = airing or min_score > 0 or season is not None or year is not None
     response = False
     anime_id = 0
     tries = 0  # Max attempts.
     while response == False and tries <= 10:
-        anime_id = random.randint(0, 60000)
-        response = client.api.getAnimeByID(str(anime_id))
+        anime_id = client.catalog.randomID(airing, min_score, year, season_value)
+        if anime_id is None:
+            if filtered:
+                await interaction.send(f"No known anime match those filters yet.")
+                return
+            anime_id = random.randint(0, 60000)
+        response = await client.api.getAnimeByID(str(anime_id))
+        if response == False:
+            if not client.api.isNotFound(anime_id):
+                break
+            client.catalog.remove(anime_id)
         tries += 1
 
-    # Timeout error.
+    # Timeout error, or MAL unreachable.
     if response == False:
-        await interaction.followup.send(f"Request timed out.")
+        await interaction.send(f"Request timed out.")
         return
     
     # Format response, retrieve cover, send.
     anime_info = botHelper.formatAnimeInfo(response)
-    picture_url = response['main_picture']['medium']
-    anime_pic = await botHelper.downloadImage(picture_url, f"{response['title']}.jpg")
+    picture_url = response.picture
+    anime_pic = await client.covers.getImage(picture_url, f"{response.title}.jpg")
     if anime_pic == False:
-        await interaction.followup.send(f"Error: Failed to retrieve image for {response['title']}.")
+        await interaction.send(f"Error: Failed to retrieve image for {response.title}.")
     else:
-        await interaction.followup.send(file=anime_pic, content=anime_info)
+        await interaction.send(file=anime_pic, content=anime_info)
 
-# Get days until next episode releases.
-@client.tree.command(name="nextepisode", description="Calculates days until next episode of given anime. (JST only.)")
-@app_commands.describe(anime_id="MAL anime id.")
-async def nextEpisode(interaction: discord.Interaction, anime_id: str):
-    fields="id,title,start_date,status,broadcast"
-    response = client.api.getAnimeByID(anime_id.strip(), fields)
-    if response == False:
-        await interaction.response.send_message(f"The requested anime could not be found.")
+# Autocomplete for IANA timezone names.
+async def timezoneAutocomplete(interaction: discord.Interaction, current: str):
+    current = current.lower().replace(" ", "_")
+    matches = [name for name in TIMEZONES if current in name.lower()]
+    return [app_commands.Choice(name=name, value=name) for name in matches[:25]]
+
+# Returns the ZoneInfo for a timezone name, None if it isn't one.
+def getTimezone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+# Get time until next episode releases.
+@client.tree.command(name="nextepisode", description="Calculates time until next episode of given anime.")
+@app_commands.describe(anime_id="MAL anime id.", timezone="Timezone to show the air time in. Default: Asia/Tokyo")
+@app_commands.autocomplete(anime_id=animeIdAutocomplete, timezone=timezoneAutocomplete)
+@runner.command(backend="/v2/anime/{id}")
+async def nextEpisode(interaction: discord.Interaction, anime_id: str, timezone: str="Asia/Tokyo"):
+    tz = getTimezone(timezone)
+    if tz is None:
+        await interaction.send(f"Unknown timezone: {timezone}")
         return
-    
-    # Time variables.
-    time_until = 0
-    today = date.today()
 
-    # Show ended.
-    if response['status'] == "finished_airing":
-        await interaction.response.send_message(f"{response['title']} has already finished airing.")
-    
-    # Not aired.
-    elif response['status'] == "not_yet_aired":
-        if "start_date" in response:
-            await interaction.response.send_message(f"{response['title']} has an air date of {response['start_date']}.\n")
+    # Airing shows are answered straight from the schedule index.
+    anime_id = anime_id.strip()
+    airing = client.schedule.nextAiring(anime_id) if anime_id.isdecimal() else None
+    if airing is None:
+        fields="id,title,start_date,status,broadcast"
+        response = await client.api.getAnimeByID(anime_id, fields)
+        if response == False:
+            await interaction.send(f"The requested anime could not be found.")
+            return
+        
+        # Show ended.
+        if response.status == "finished_airing":
+            await interaction.send(f"{response.title} has already finished airing.")
+            return
+        
+        # Not aired.
+        elif response.status == "not_yet_aired":
+            if response.start_date is not None:
+                await interaction.send(f"{response.title} has an air date of {response.start_date}.\n")
+            else:
+                await interaction.send(f"{response.title} hasn't begun airing yet.")
+            return
+        
+        # Airing, but only usable if MAL knows the broadcast slot.
+        elif response.status == "currently_airing":
+            airing = client.schedule.nextAiring(anime_id)
+            if airing is None:
+                await interaction.send(f"{response.title} is airing, but has no broadcast time listed.")
+                return
+
+        # Fall-through.
         else:
-            await interaction.response.send_message(f"{response['title']} hasn't begun airing yet.")
-    
+            await interaction.send(f"{response.title} has an unknown status.")
+            return
+
     # Airing.
-    elif response['status'] == "currently_airing":
-        broadcast = response['broadcast']
-        reply = f"{response['title']} airs at {broadcast['start_time']} on {broadcast['day_of_the_week'].capitalize()}s!\n"
-
-        # Calculate next day of next episode.
-        next_ep_date = botHelper.nextDay(today, broadcast['day_of_the_week'])
-        time_until = (next_ep_date - today).days
-        if time_until == 0:
-            reply += f"The next episode airs today at {broadcast['start_time']}! (Or at least it should.)"
-        else:
-            reply += f"The next episode (should) air in {time_until} day(s)."
-        
-        await interaction.response.send_message(reply)
+    title, day, start_time, next_air = airing
+    reply = f"{title} airs at {start_time or '??:??'} JST on {day.capitalize()}s!\n"
+    local_air = next_air.astimezone(tz)
+    time_until = botHelper.formatDuration(next_air - datetime.now(next_air.tzinfo))
+    reply += f"The next episode (should) air {local_air.strftime('%a %Y-%m-%d %H:%M')} {timezone}, in {time_until}."
+    await interaction.send(reply)
 
-    # Fall-through.
+# Enum to enable slash command choices.
+class ScheduleDay(Enum):
+    next_24_hours = "next"
+    today = "today"
+    monday = "monday"
+    tuesday = "tuesday"
+    wednesday = "wednesday"
+    thursday = "thursday"
+    friday = "friday"
+    saturday = "saturday"
+    sunday = "sunday"
+
+# Broadcast schedule, served entirely from the schedule index.
+@client.tree.command(name="schedule", description="Lists airing anime by broadcast time.")
+@app_commands.describe(day="Day to list. Default: next 24 hours", timezone="Timezone to show times in. Default: Asia/Tokyo")
+@app_commands.autocomplete(timezone=timezoneAutocomplete)
+@runner.command()
+async def schedule(interaction: discord.Interaction, day: ScheduleDay=ScheduleDay.next_24_hours, timezone: str="Asia/Tokyo"):
+    tz = getTimezone(timezone)
+    if tz is None:
+        await interaction.send(f"Unknown timezone: {timezone}")
+        return
+    if len(client.schedule) == 0:
+        await interaction.send(f"The schedule hasn't been built yet. Try again in a minute.")
+        return
+
+    # Work out the window in the caller's timezone.
+    now = datetime.now(tz)
+    if day == ScheduleDay.next_24_hours:
+        start = now
+        header = f"Airing in the next 24 hours ({timezone}):"
     else:
-        await interaction.response.send_message(f"{response['title']} has an unknown status.")
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if day != ScheduleDay.today:
+            start += timedelta(days=(botHelper.WEEKDAYS[day.value] - now.weekday()) % 7)
+        header = f"Airing on {start.strftime('%A %Y-%m-%d')} ({timezone}):"
+    upcoming = client.schedule.upcoming(start, start + timedelta(days=1))
+
+    # Format response.
+    lines = [f"{air.astimezone(tz).strftime('%H:%M')} {title} (ID: {anime_id})" for air, anime_id, title in upcoming]
+    await messageRenderer.sendPages(interaction, messageRenderer.listEmbeds(header, lines, empty="Nothing scheduled."))
 
 # Enums to enable slash command choices.
 class ListSort(Enum):
@@ -241,25 +564,170 @@ class Status(Enum):
 
 # Retrieve a user's anime list.
 @client.tree.command(name="getuseranimelist", description="Retrieves a given user's anime list.")
-@app_commands.describe(user_name="MAL username.", status="Watch status.", sort="Sort by.", limit="Number of results to return. Default: 10, Limit: 20")
+@app_commands.describe(user_name="MAL username.", status="Watch status.", sort="Sort by.", limit="Results per page. Default: 10, Limit: 20")
+@runner.command(backend="/v2/users/{user}/animelist")
 async def getUserAnimelist(interaction: discord.Interaction, user_name: str, status: Status, sort: ListSort, limit: int=10):
     if user_name == "":
-        await interaction.response.send_message(f"Please specify a user.")
+        await interaction.send(f"Please specify a user.")
         return
     
-    # Call API.
-    response = client.api.getUserAnimeList(user_name, status.value, sort.value, limit)
-    if response == False:
-        await interaction.response.send_message(f"User not found.")
+    limit = min(max(limit, 1), client.api.limit_cap)
+
+    # Format a page.
+    def render(items, start):
+        lines = [f"#{i} {item.title} (ID: {item.id})\n   Status: {item.list_status.capitalize()}   Score: {item.list_score}"
+                 for i, item in enumerate(items, start + 1)]
+        return messageRenderer.listEmbeds(f"User: {user_name}", lines, footer=f"Page {start // limit + 1}")[0]
+
+    # Pages are fetched from MAL only as they're opened.
+    entries = client.api.iterUserAnimeList(user_name, status.value, sort.value, page_size=limit * 5, prefetch=0)
+    view = botHelper.PagedView(entries, render, limit)
+    results = await view.renderPage()
+    if results is None:
+        await interaction.send(f"User not found.")
         return
-    
-    # Format response.
-    results = f"User: {user_name}\n" # Header.
-    i = 1
-    for item in response:
-        results += f"#{i} {item['title']} (ID: {item['id']})\n   Status: {item['status'].capitalize()}   Score: {item['score']}\n"
-        i += 1
-    await interaction.response.send_message(results)
+    view.message = await interaction.send(embed=results, view=view)
+
+# Link a MAL account to the caller for /guildrecommend.
+@client.tree.command(name="linkmal", description="Links your MAL account in this server for recommendations.")
+@app_commands.describe(user_name="MAL username. Leave empty to unlink.")
+@runner.command()
+async def linkMal(interaction: discord.Interaction, user_name: str=""):
+    if interaction.guild is None:
+        await interaction.send(f"This command only works in a server.")
+        return
+
+    user_name = user_name.strip()
+    if user_name == "":
+        client.store.linkUser(interaction.guild.id, interaction.user.id, None)
+        await interaction.send(f"Unlinked your MAL account.", ephemeral=True)
+        return
+
+    client.store.linkUser(interaction.guild.id, interaction.user.id, user_name)
+    await interaction.send(f"Linked to MAL user {user_name}.", ephemeral=True)
+
+# Compare two users' lists.
+@client.tree.command(name="compare", description="Compares two users' anime lists.")
+@app_commands.describe(user_a="MAL username.", user_b="MAL username.")
+@runner.command(backend="/v2/users/{user}/animelist")
+async def compareLists(interaction: discord.Interaction, user_a: str, user_b: str):
+    list_a, list_b = await client.lists.getLists([user_a.strip(), user_b.strip()])
+    for name, packed in ((user_a, list_a), (user_b, list_b)):
+        if packed == False:
+            await interaction.send(f"Could not get the list for {name}.")
+            return
+
+    result = client.lists.compare(list_a, list_b)
+    results = f"{user_a} vs {user_b}\n"
+    results += f"Shared: {result['shared']} (only {user_a}: {result['only_a']}, only {user_b}: {result['only_b']})\n"
+    results += f"Overlap: {result['jaccard']:.0%}\n"
+    if result['correlation'] is None:
+        results += f"Score correlation: not enough shared scores ({result['both_scored']})\n"
+    else:
+        results += f"Score correlation: {result['correlation']:+.2f} over {result['both_scored']} shows\n"
+        results += f"Average score difference: {result['mean_difference']:.2f}\n"
+    if result['disagreements']:
+        results += "Biggest disagreements:\n"
+        for anime_id, score_a, score_b in result['disagreements']:
+            title = client.search.titles.get(anime_id, f"ID {anime_id}")
+            results += f"   {title}: {score_a} vs {score_b}\n"
+    await interaction.send(results)
+
+# Recommend anime from the lists of everyone linked in the server.
+@client.tree.command(name="guildrecommend", description="Recommends anime based on the lists of linked server members.")
+@app_commands.describe(user_name="MAL username to recommend for. Default: your linked account.", limit="Results. Default: 10, Limit: 20")
+@runner.command(backend="/v2/users/{user}/animelist")
+async def guildRecommend(interaction: discord.Interaction, user_name: str="", limit: int=10):
+    if interaction.guild is None:
+        await interaction.send(f"This command only works in a server.")
+        return
+
+    links = client.store.guildLinks(interaction.guild.id)
+    user_name = user_name.strip() or links.get(interaction.user.id, "")
+    if user_name == "":
+        await interaction.send(f"Link your MAL account with /linkmal or give a username.")
+        return
+    others = sorted({name for name in links.values() if name.lower() != user_name.lower()})
+    if len(others) == 0:
+        await interaction.send(f"No other linked members in this server yet.")
+        return
+
+    limit = min(max(limit, 1), client.api.limit_cap)
+
+    lists = await client.lists.getLists([user_name] + others)
+    if lists[0] == False:
+        await interaction.send(f"Could not get the list for {user_name}.")
+        return
+    recommendations = client.lists.recommend(lists[0], [packed for packed in lists[1:] if packed != False], limit)
+    if len(recommendations) == 0:
+        await interaction.send(f"Not enough overlap with other members' lists to recommend anything.")
+        return
+
+    lines = [f"#{i} {client.search.titles.get(anime_id, f'ID {anime_id}')} (ID: {anime_id})\n"
+             f"   Predicted: {predicted:.1f}   Scored by: {support} members"
+             for i, (anime_id, predicted, support) in enumerate(recommendations, 1)]
+    await messageRenderer.sendPages(interaction, messageRenderer.listEmbeds(f"Recommended for {user_name}:", lines))
+
+# Post linked members' list updates in this channel.
+@client.tree.command(name="watchchannel", description="Posts linked members' MAL list updates in this channel.")
+@app_commands.describe(enabled="Turn list update posts on or off. Default: on")
+@app_commands.default_permissions(manage_guild=True)
+@runner.command()
+async def watchChannel(interaction: discord.Interaction, enabled: bool=True):
+    if interaction.guild is None:
+        await interaction.send(f"This command only works in a server.")
+        return
+
+    if enabled:
+        client.store.setWatchChannel(interaction.guild.id, interaction.channel_id)
+        await interaction.send(f"List updates from members linked with /linkmal will be posted here.")
+    else:
+        client.store.setWatchChannel(interaction.guild.id, None)
+        await interaction.send(f"List updates turned off.")
+
+# Bot performance summary. Owner only.
+@client.tree.command(name="botstats", description="Shows bot latency and cache statistics. (Owner only.)")
+@runner.command()
+async def botStats(interaction: discord.Interaction):
+    if not await client.is_owner(interaction.user):
+        await interaction.send(f"This command is owner only.", ephemeral=True)
+        return
+
+    # Command latency.
+    results = "Commands (p50 / p95, count):\n"
+    for key in sorted(metrics.command_latency.series):
+        labels = dict(key)
+        p50 = metrics.command_latency.quantile(0.5, **labels)
+        p95 = metrics.command_latency.quantile(0.95, **labels)
+        results += f"  /{labels['command']}: {p50 * 1000:.0f}ms / {p95 * 1000:.0f}ms, {metrics.command_latency.count(**labels)}\n"
+
+    # MAL latency and status codes.
+    results += "MAL endpoints (p50 / p95, count):\n"
+    for key in sorted(metrics.mal_latency.series):
+        labels = dict(key)
+        p50 = metrics.mal_latency.quantile(0.5, **labels)
+        p95 = metrics.mal_latency.quantile(0.95, **labels)
+        results += f"  {labels['endpoint']}: {p50 * 1000:.0f}ms / {p95 * 1000:.0f}ms, {metrics.mal_latency.count(**labels)}\n"
+    statuses = ", ".join(f"{dict(key)['status']}: {count}" for key, count in sorted(metrics.mal_responses.values.items()))
+    results += f"MAL responses: {statuses or 'none'}\n"
+
+    # Caches, rate limiter and event loop.
+    api_cache = client.api.cache.stats()
+    covers = client.covers.stats()
+    scheduler = client.api.scheduler.stats()
+    results += f"Response cache: {api_cache['hit_ratio']:.0%} hits, {api_cache['entries']} entries\n"
+    results += f"Cover cache: {covers['hit_ratio']:.0%} hits, {covers['bytes'] // 1024} KiB\n"
+    results += f"MAL queue: {scheduler['queue_depth']}, in flight: {scheduler['in_flight']}\n"
+    breaker = client.api.breaker.stats()
+    results += f"MAL circuit: {breaker['state']}, opened {breaker['opened']} times, {breaker['rejected']} requests failed fast\n"
+    renders = client.renders.stats()
+    results += f"Render cache: {renders['hit_ratio']:.0%} hits, {renders['entries']} entries\n"
+    prefetch = client.prefetch.stats()
+    results += f"Prefetch: {prefetch['hit_ratio']:.0%} of lookups warmed, {prefetch['fetched']} fetched, {prefetch['pending']} queued\n"
+    watcher = client.watcher.stats()
+    results += f"List watcher: {watcher['users']} users, {watcher['requests_per_poll']:.2f} requests per poll\n"
+    results += f"Event loop lag: {metrics.loop_lag.values.get((), 0) * 1000:.1f}ms"
+    await interaction.send(results[:2000], ephemeral=True)
 
 # Start the bot.
 def start():
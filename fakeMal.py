@@ -0,0 +1,218 @@
+# fakeMal.py
+# Local stand-in for the MAL API, for benchmarks. Serves generated but
+# realistically shaped JSON for the endpoints malAPI uses, plus cover
+# images, with adjustable latency and error rates.
+import asyncio
+import random
+from aiohttp import web
+
+WORDS = ["shingeki", "kyojin", "steins", "gate", "kimi", "no", "na", "wa", "sword", "art",
+         "online", "boku", "hero", "academia", "one", "piece", "naruto", "bleach", "death",
+         "note", "cowboy", "bebop", "spy", "family", "chainsaw", "man", "frieren", "oshi",
+         "ko", "kaguya", "sama", "love", "is", "war", "jujutsu", "kaisen", "mob", "psycho",
+         "hunter", "x", "fullmetal", "alchemist", "brotherhood", "vinland", "saga", "monster"]
+SEASONS = ["winter", "spring", "summer", "fall"]
+STATUSES = ["finished_airing"] * 8 + ["currently_airing", "not_yet_aired"]
+DAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+LIST_STATUSES = ["watching", "completed", "on_hold", "dropped", "plan_to_watch"]
+
+class FakeMAL:
+
+    def __init__(self, anime_count=5000, id_stride=3, latency=0.05, jitter=0.02,
+                 error_rate=0.0, throttle_rate=0.0, image_bytes=30000, seed=1):
+        # Response shaping.
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate        # Chance of an HTML 500.
+        self.throttle_rate = throttle_rate  # Chance of a 429.
+        self.image = bytes(random.Random(seed).getrandbits(8) for _ in range(image_bytes))
+        self._random = random.Random(seed)
+
+        # Only every id_stride-th ID exists, like MAL's sparse ID space.
+        rng = random.Random(seed)
+        self.anime = {}
+        for i in range(anime_count):
+            anime_id = 1 + i * id_stride
+            year = rng.randint(1995, 2026)
+            title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title()
+            status = rng.choice(STATUSES)
+            node = {'id': anime_id,
+                    'title': title,
+                    'alternative_titles': {'synonyms': [], 'en': title.upper(), 'ja': ""},
+                    'start_date': f"{year}-{rng.randint(1, 12):02d}-01",
+                    'mean': round(rng.uniform(5.0, 9.2), 2),
+                    'num_episodes': rng.choice([12, 13, 24, 25, 0]),
+                    'start_season': {'year': year, 'season': rng.choice(SEASONS)},
+                    'status': status,
+                    'media_type': rng.choice(["tv", "movie", "ova", "special"]),
+                    'num_list_users': rng.randint(100, 3000000)}
+            if status == "finished_airing":
+                node['end_date'] = f"{year}-12-31"
+            if status == "currently_airing":
+                node['broadcast'] = {'day_of_the_week': rng.choice(DAYS),
+                                     'start_time': f"{rng.randint(0, 23):02d}:{rng.choice(['00', '30'])}"}
+            self.anime[anime_id] = node
+        self.by_score = sorted(self.anime.values(), key=lambda a: -a['mean'])
+
+        # Request counts by endpoint.
+        self.calls = {}
+        self.root_url = None
+        self.base_url = None
+        self._runner = None
+
+    # Starts serving on host:port (0 picks a free port). Returns the API base URL.
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_get("/v2/anime", self.search)
+        app.router.add_get("/v2/anime/ranking", self.ranking)
+        app.router.add_get("/v2/anime/season/{year}/{season}", self.season)
+        app.router.add_get("/v2/anime/{anime_id}", self.details)
+        app.router.add_get("/v2/users/{user_name}/animelist", self.userList)
+        app.router.add_get("/images/{anime_id}.jpg", self.cover)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        port = self._runner.addresses[0][1]
+        self.root_url = f"http://{host}:{port}"
+        self.base_url = self.root_url + "/v2"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def totalCalls(self):
+        return sum(self.calls.values())
+
+    # Common latency/error handling. Returns an error response or None.
+    async def _simulate(self, endpoint):
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        await asyncio.sleep(max(0.0, self._random.gauss(self.latency, self.jitter)))
+        roll = self._random.random()
+        if roll < self.error_rate:
+            return web.Response(status=500, text="<html><body>Internal Server Error</body></html>",
+                                content_type="text/html")
+        if roll < self.error_rate + self.throttle_rate:
+            return web.json_response({'error': "too_many_requests"}, status=429)
+        return None
+
+    # Picks the requested fields out of a node (id and title always come back).
+    def _node(self, anime, fields):
+        node = {'id': anime['id'], 'title': anime['title'],
+                'main_picture': {'medium': f"{self.root_url}/images/{anime['id']}.jpg",
+                                 'large': f"{self.root_url}/images/{anime['id']}.jpg"}}
+        for field in fields.split(","):
+            if field in anime:
+                node[field] = anime[field]
+        return node
+
+    # Slices a list into a MAL-style page with paging.next.
+    def _page(self, request, items, wrap, max_limit):
+        limit = min(int(request.query.get('limit', 100) or 100), max_limit)
+        offset = int(request.query.get('offset', 0) or 0)
+        page = items[offset:offset + limit]
+        paging = {}
+        if offset + limit < len(items):
+            paging['next'] = f"{self.base_url}{request.path}?offset={offset + limit}&limit={limit}"
+        return web.json_response({'data': [wrap(i, item) for i, item in enumerate(page, offset)],
+                                  'paging': paging})
+
+    async def search(self, request):
+        error = await self._simulate("search")
+        if error is not None:
+            return error
+        query = request.query.get('q', "").lower()
+        if len(query) < 3:
+            return web.json_response({'error': "invalid_parameter"}, status=400)
+        fields = request.query.get('fields', "")
+        matches = [a for a in self.anime.values() if query in a['title'].lower()]
+        return self._page(request, matches, lambda i, a: {'node': self._node(a, fields)}, 100)
+
+    async def details(self, request):
+        error = await self._simulate("details")
+        if error is not None:
+            return error
+        anime = self.anime.get(int(request.match_info['anime_id']))
+        if anime is None:
+            return web.json_response({'error': "not_found"}, status=404)
+        return web.json_response(self._node(anime, request.query.get('fields', "")))
+
+    async def ranking(self, request):
+        error = await self._simulate("ranking")
+        if error is not None:
+            return error
+        ranking_type = request.query.get('ranking_type', "all")
+        items = self.by_score
+        if ranking_type == "airing":
+            items = [a for a in items if a['status'] == "currently_airing"]
+        elif ranking_type == "upcoming":
+            items = [a for a in items if a['status'] == "not_yet_aired"]
+        elif ranking_type in ("tv", "movie", "ova", "special"):
+            items = [a for a in items if a['media_type'] == ranking_type]
+        elif ranking_type in ("bypopularity", "favorite"):
+            items = sorted(items, key=lambda a: -a['num_list_users'])
+        fields = request.query.get('fields', "")
+        return self._page(request, items, lambda i, a: {'node': self._node(a, fields),
+                                                         'ranking': {'rank': i + 1}}, 500)
+
+    async def season(self, request):
+        error = await self._simulate("season")
+        if error is not None:
+            return error
+        year = int(request.match_info['year'])
+        season = request.match_info['season']
+        items = [a for a in self.by_score
+                 if a['start_season']['year'] == year and a['start_season']['season'] == season]
+        if request.query.get('sort') == "anime_num_list_users":
+            items = sorted(items, key=lambda a: -a['num_list_users'])
+        fields = request.query.get('fields', "")
+        return self._page(request, items, lambda i, a: {'node': self._node(a, fields)}, 500)
+
+    # Each user gets a deterministic list built from a hash of their name.
+    async def userList(self, request):
+        error = await self._simulate("user_list")
+        if error is not None:
+            return error
+        user_name = request.match_info['user_name']
+        rng = random.Random(user_name)
+        ids = sorted(self.anime)
+        entries = rng.sample(ids, min(len(ids), rng.randint(50, 1200)))
+        status = request.query.get('status', "")
+        items = []
+        for anime_id in entries:
+            list_status = {'status': rng.choice(LIST_STATUSES), 'score': rng.randint(0, 10),
+                           'updated_at': f"2026-{rng.randint(1, 9):02d}-{rng.randint(1, 28):02d}T12:00:00+00:00"}
+            if status == "" or list_status['status'] == status:
+                items.append((self.anime[anime_id], list_status))
+        sort = request.query.get('sort', "anime_title")
+        if sort == "list_score":
+            items.sort(key=lambda item: -item[1]['score'])
+        elif sort == "list_updated_at":
+            items.sort(key=lambda item: item[1]['updated_at'], reverse=True)
+        elif sort == "anime_start_date":
+            items.sort(key=lambda item: item[0]['start_date'], reverse=True)
+        else:
+            items.sort(key=lambda item: item[0]['title'])
+        return self._page(request, items, lambda i, item: {'node': self._node(item[0], ""),
+                                                            'list_status': item[1]}, 1000)
+
+    async def cover(self, request):
+        error = await self._simulate("cover")
+        if error is not None:
+            return error
+        return web.Response(body=self.image, content_type="image/jpeg")
+
+# Runs the stand-in on its own, e.g. to point a dev bot at it with MAL_BASE_URL.
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Local MAL API stand-in.")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    async def main():
+        fake = FakeMAL(latency=args.latency, error_rate=args.error_rate)
+        print(f"Serving MAL stand-in at {await fake.start(port=args.port)}")
+        await asyncio.Event().wait()
+    asyncio.run(main())
@@ -0,0 +1,192 @@
+# listAnalysis.py
+# User list comparison and recommendations. Lists are packed into sorted
+# NumPy arrays (anime IDs and scores) and compared on a shared ID axis.
+import asyncio
+import numpy as np
+import time
+from collections import OrderedDict
+from malApi import PaginationError
+
+# A user's packed list. Scores are MAL's 1-10, with 0 for unscored.
+class PackedList:
+    __slots__ = ('user_name', 'ids', 'scores', 'fetched_at')
+
+    def __init__(self, user_name, ids, scores, fetched_at):
+        self.user_name = user_name
+        self.ids = ids          # int32, sorted, unique
+        self.scores = scores    # float32, aligned with ids
+        self.fetched_at = fetched_at
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def fromRecords(cls, user_name, records):
+        ids = np.fromiter((record.id for record in records), np.int32, len(records))
+        scores = np.fromiter((record.list_score or 0 for record in records), np.float32, len(records))
+        ids, first = np.unique(ids, return_index=True)
+        return cls(user_name, ids, scores[first], time.time())
+
+# Pearson correlation of two aligned score vectors, None if too few points.
+def _correlation(a, b, min_points=3):
+    if len(a) < min_points:
+        return None
+    a = a - a.mean()
+    b = b - b.mean()
+    denominator = np.sqrt((a * a).sum() * (b * b).sum())
+    if denominator == 0:
+        return None
+    return float((a * b).sum() / denominator)
+
+class ListAnalyzer:
+
+    def __init__(self, api, ttl=1800, max_users=500, page_size=500, concurrency=4):
+        self.api = api
+        # Packed lists by lowercased user name, least recently used first.
+        self.ttl = ttl
+        self.max_users = max_users
+        self._lists = OrderedDict()
+        # Fetches already running, so concurrent commands share one.
+        self._pending = {}
+        self.page_size = page_size
+        self.concurrency = concurrency
+
+        # Counters.
+        self.hits = 0
+        self.misses = 0
+
+    # Returns a user's packed list, False if it couldn't be fetched or is empty.
+    async def getList(self, user_name):
+        key = user_name.lower()
+        packed = self._lists.get(key)
+        if packed is not None and time.time() < packed.fetched_at + self.ttl:
+            self._lists.move_to_end(key)
+            self.hits += 1
+            return packed
+
+        if key not in self._pending:
+            self.misses += 1
+            self._pending[key] = asyncio.ensure_future(self._load(key, user_name))
+        return await asyncio.shield(self._pending[key])
+
+    # Returns packed lists for every name given, in order (False for failures).
+    async def getLists(self, user_names):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(user_name):
+            async with semaphore:
+                return await self.getList(user_name)
+
+        return await asyncio.gather(*(fetch(user_name) for user_name in user_names))
+
+    # Fetches every page of the list and packs it. A list that couldn't be
+    # read to the end is never packed or cached.
+    async def _load(self, key, user_name):
+        try:
+            records = []
+            try:
+                async for record in self.api.iterUserAnimeList(user_name, page_size=self.page_size, prefetch=2):
+                    records.append(record)
+            except PaginationError:
+                return False
+            if len(records) == 0:
+                return False  # Unknown user, private list or MAL down.
+            packed = PackedList.fromRecords(user_name, records)
+            self._lists[key] = packed
+            self._lists.move_to_end(key)
+            while len(self._lists) > self.max_users:
+                self._lists.popitem(last=False)
+            return packed
+        finally:
+            self._pending.pop(key, None)
+
+    # Drops a cached list so the next lookup refetches it.
+    def invalidate(self, user_name):
+        self._lists.pop(user_name.lower(), None)
+
+    # Compares two packed lists. Returns a dict with the overlap, score
+    # correlation over anime both have scored, mean score difference and
+    # the biggest disagreements as [(id, score_a, score_b)].
+    @staticmethod
+    def compare(a, b, disagreements=3):
+        shared, index_a, index_b = np.intersect1d(a.ids, b.ids, assume_unique=True, return_indices=True)
+        scores_a = a.scores[index_a]
+        scores_b = b.scores[index_b]
+        scored = (scores_a > 0) & (scores_b > 0)
+        scores_a = scores_a[scored]
+        scores_b = scores_b[scored]
+        scored_ids = shared[scored]
+
+        gaps = np.abs(scores_a - scores_b)
+        order = np.argsort(-gaps, kind="stable")[:disagreements]
+        union = len(a) + len(b) - len(shared)
+        return {'shared': len(shared),
+                'only_a': len(a) - len(shared),
+                'only_b': len(b) - len(shared),
+                'jaccard': len(shared) / union if union else 0.0,
+                'both_scored': int(scored.sum()),
+                'correlation': _correlation(scores_a, scores_b),
+                'mean_difference': float(gaps.mean()) if len(gaps) else None,
+                'disagreements': [(int(scored_ids[i]), int(scores_a[i]), int(scores_b[i]))
+                                  for i in order if gaps[i] > 0]}
+
+    # Recommends anime the target hasn't listed, from the other lists.
+    # Every list is mean-centred and laid out on one anime ID axis; each
+    # other user is weighted by their score correlation with the target
+    # (shrunk toward 0 on small overlaps), and candidates are ranked by the
+    # weighted average of centred scores, damped toward the target's mean
+    # when few users back it. Returns [(id, predicted score, supporting
+    # users)], best first.
+    @staticmethod
+    def recommend(target, others, limit=10, min_overlap=5, min_support=2, shrinkage=10, damping=1.0):
+        others = [other for other in others if len(other) > 0]
+        if len(target) == 0 or len(others) == 0:
+            return []
+
+        # Users x anime score matrix, 0 where unscored.
+        lists = [target] + others
+        axis = np.unique(np.concatenate([packed.ids for packed in lists]))
+        scores = np.zeros((len(lists), len(axis)), np.float32)
+        for row, packed in enumerate(lists):
+            scores[row, np.searchsorted(axis, packed.ids)] = packed.scores
+        scored = scores > 0
+
+        # Centre each user's scores on their own mean.
+        counts = scored.sum(axis=1)
+        means = np.divide(scores.sum(axis=1), counts, out=np.zeros(len(lists), np.float32), where=counts > 0)
+        centred = np.where(scored, scores - means[:, None], 0.0)
+
+        # Correlation with the target over anime both have scored.
+        other_centred = centred[1:]
+        other_scored = scored[1:].astype(np.float32)
+        target_centred = centred[0]
+        target_scored = scored[0].astype(np.float32)
+        overlap = other_scored @ target_scored
+        numerator = other_centred @ target_centred
+        denominator = np.sqrt((other_centred ** 2) @ target_scored * (other_scored @ target_centred ** 2))
+        similarity = np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+        weights = np.clip(similarity, 0, None) * overlap / (overlap + shrinkage)
+        weights[overlap < min_overlap] = 0
+        if not weights.any():
+            return []
+
+        # Damped weighted average of centred scores, on the target's scale.
+        weighted = weights @ other_centred
+        weight_sums = weights @ other_scored
+        support = (weights > 0).astype(np.float32) @ other_scored
+        predicted = means[0] + weighted / (weight_sums + damping)
+
+        # Only anime the target hasn't listed at all.
+        candidates = np.ones(len(axis), bool)
+        candidates[np.searchsorted(axis, target.ids)] = False
+        candidates &= support >= min_support
+        indexes = np.flatnonzero(candidates)
+        best = indexes[np.argsort(-predicted[indexes], kind="stable")[:limit]]
+        return [(int(axis[i]), float(min(predicted[i], 10.0)), int(support[i])) for i in best]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._lists)}
@@ -0,0 +1,169 @@
+# listWatcher.py
+# Background watcher for linked users' MAL lists. Each user's newest seen
+# list_updated_at is kept as a high-water mark, so a poll reads lists
+# sorted by last update and stops at the first entry it has already seen:
+# usually one small request per user. Users who update often are polled
+# more often, quiet ones back off, and polls are jittered so they spread
+# out instead of bunching up.
+import asyncio
+import heapq
+import random
+import time
+from datetime import datetime, timezone
+from requestScheduler import BACKGROUND, setPriority
+
+# Parses MAL's ISO timestamps (which carry an offset) for comparison.
+# Unparseable ones sort first.
+def _updatedAt(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return datetime.min.replace(tzinfo=timezone.utc)
+
+class ListWatcher:
+
+    def __init__(self, api, store, notify, min_interval=600, max_interval=6 * 3600,
+                 page_size=10, max_pages=5, targets_interval=60, owns=None):
+        self.api = api
+        self.store = store
+        # Optional owns(guild_id) filter, so each shard process only watches
+        # for the guilds it serves.
+        self.owns = owns
+        # Coroutine function notify(mal_name, channel_ids, records), given
+        # each user's new updates, oldest first.
+        self.notify = notify
+
+        # Poll interval bounds in seconds, and how much one poll may read.
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.page_size = page_size
+        self.max_pages = max_pages
+
+        # Watched users by lowercased name: [name, channel ids, high water
+        # mark, interval, next poll time]. The heap holds (next poll time,
+        # name); entries that no longer match the user's time are stale.
+        self.users = {}
+        self._heap = []
+        self.targets_interval = targets_interval
+        self._targets_at = 0.0
+
+        # Counters.
+        self.polls = 0
+        self.requests = 0
+        self.updates = 0
+
+    def __len__(self):
+        return len(self.users)
+
+    # Syncs the watched users with the store's links and watch channels.
+    # New users get their first poll at a random point in the next minimum
+    # interval, so a restart doesn't poll everyone at once.
+    def refreshTargets(self, now=None):
+        now = now or time.time()
+        targets = self.store.watchTargets(self.owns)
+        marks = self.store.watchMarks()
+        for key in list(self.users):
+            if key not in targets:
+                del self.users[key]
+        for key, (mal_name, channel_ids) in targets.items():
+            user = self.users.get(key)
+            if user is not None:
+                user[0], user[1] = mal_name, channel_ids
+                continue
+            high_water, interval = marks.get(key, (None, self.min_interval))
+            self.users[key] = [mal_name, channel_ids, high_water, interval, None]
+            self._schedule(key, now + random.uniform(0, self.min_interval))
+        self._targets_at = now
+
+    def _schedule(self, key, due):
+        self.users[key][4] = due
+        heapq.heappush(self._heap, (due, key))
+
+    # Reads a user's newest updates down to the high-water mark. Returns
+    # the new records, oldest first, or False if MAL couldn't be reached.
+    async def poll(self, key):
+        mal_name, channel_ids, high_water, interval, _ = self.users[key]
+        mark = _updatedAt(high_water) if high_water is not None else None
+        self.polls += 1
+
+        new = []
+        newest = high_water
+        for page_number in range(self.max_pages):
+            self.requests += 1
+            page = await self.api.pollUserAnimeList(mal_name, self.page_size, page_number * self.page_size)
+            if page == False:
+                return False
+            records, has_next = page
+            if page_number == 0 and len(records) > 0:
+                newest = records[0].list_updated_at
+            reached_mark = mark is None
+            for record in records:
+                if mark is not None and _updatedAt(record.list_updated_at) <= mark:
+                    reached_mark = True
+                    break
+                if mark is not None:
+                    new.append(record)
+            if reached_mark or not has_next:
+                break
+
+        # First poll only sets the mark; there's nothing to compare against.
+        self.users[key][2] = newest
+        new.reverse()
+        return new
+
+    # Halves the interval after activity, stretches it after a quiet poll.
+    def _nextInterval(self, interval, active):
+        if active:
+            return max(self.min_interval, interval / 2)
+        return min(self.max_interval, interval * 1.5)
+
+    # Polls one user, posts their updates and schedules the next poll.
+    async def _pollUser(self, key):
+        user = self.users[key]
+        interval = user[3]  # On failure, try again on the same schedule.
+        try:
+            new = await self.poll(key)
+            if new != False:
+                interval = self._nextInterval(user[3], len(new) > 0)
+                user[3] = interval
+                if user[2] is not None:
+                    self.store.putWatchMark(user[0], user[2], interval)
+                if new:
+                    self.updates += len(new)
+                    await self.notify(user[0], user[1], new)
+        finally:
+            # Skip if the user was untracked (or re-added) while polling.
+            if self.users.get(key) is user:
+                self._schedule(key, time.time() + interval * random.uniform(0.8, 1.2))
+
+    # Background task: polls users as they come due.
+    async def watchLoop(self, concurrency=4):
+        setPriority(BACKGROUND)
+        semaphore = asyncio.Semaphore(concurrency)
+        running = set()
+
+        async def run(key):
+            async with semaphore:
+                await self._pollUser(key)
+
+        while True:
+            now = time.time()
+            if now >= self._targets_at + self.targets_interval:
+                self.refreshTargets(now)
+            while self._heap and self._heap[0][0] <= now:
+                due, key = heapq.heappop(self._heap)
+                user = self.users.get(key)
+                if user is None or user[4] != due:
+                    continue
+                task = asyncio.create_task(run(key))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            next_due = self._heap[0][0] if self._heap else now + self.targets_interval
+            await asyncio.sleep(min(max(next_due - now, 0.5), self.targets_interval))
+
+    def stats(self):
+        return {'users': len(self.users),
+                'polls': self.polls,
+                'requests': self.requests,
+                'requests_per_poll': self.requests / self.polls if self.polls else 0.0,
+                'updates': self.updates}
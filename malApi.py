@@ -1,79 +1,226 @@
 # malApi.py
-import requests
+import aiohttp
+import asyncio
+import json
 import os
-from datetime import date, datetime
+import metrics
+import random
+import time
+from collections import OrderedDict, deque
+from animeRecord import AnimeRecord, parseAnime, parseNodeList, parseRanking, parseUserList
+from apiLogger import ApiLogger
+from circuitBreaker import HALF_OPEN, CircuitBreaker
 from dotenv import load_dotenv
+from requestScheduler import INTERACTIVE, RequestScheduler, request_priority
+from responseCache import ResponseCache
 load_dotenv()  # Load necessary keys.
 
+# Outcomes of a single request attempt.
+OK = "ok"
+CLIENT_ERROR = "client_error"  # 4xx: retrying won't help.
+THROTTLED = "throttled"        # 429/403: retry once the scheduler's pause is over.
+SERVER_ERROR = "server_error"  # 5xx, timeouts, connection errors: retry, counts against the breaker.
+QUEUED = "queued"              # Deadline passed before the request left the local queue: MAL isn't at fault.
+
+# Raised by the iter* methods when a page can't be fetched, so a walk that
+# was cut short can't be mistaken for the end of the list.
+class PaginationError(Exception):
+    pass
+
 class malAPI:
 
-    def __init__(self):
+    def __init__(self, connection_limit=20, per_host_limit=10, keepalive_timeout=60,
+                 total_timeout=10, connect_timeout=5, cache_entries=2048,
+                 rate=2.0, burst=5, max_concurrent=4, store=None,
+                 log_dir=".", log_requests=False, base_url="https://api.myanimelist.net/v2",
+                 deadline=15, retries=2, backoff_base=0.5, backoff_cap=8.0, hedge_after=None,
+                 breaker_threshold=5, breaker_reset=30.0, rate_bucket=None):
         # Keys.
         self.client_secret = os.getenv("CLIENT_SECRET")
-        self.client_auth = {'X-MAL-CLIENT-ID': os.getenv("CLIENT_ID")}
+        self.client_auth = {'X-MAL-CLIENT-ID': os.getenv("CLIENT_ID", "")}
         
-        # Log file.
-        today = date.today()
-        log_date = today.strftime("%Y%m%d")
-        self.log_file = f"{log_date}_api_log.txt"
+        # Log file(s). Writes happen on the logger's own thread.
+        self.logger = ApiLogger(log_dir=log_dir)
+        self.log_requests = log_requests  # Log successful requests too.
 
+        self.base_url = base_url.rstrip("/")  # Swapped out for a local stand-in when benchmarking.
         self.limit_cap = 20  # Limit param cap.
+        self.page_size_cap = 500  # Page size cap when paginating.
+
+        # Extra fields requested on list endpoints so indexes can use them.
+        self.list_fields = "alternative_titles,mean,status,start_season,media_type,broadcast"
+        # Default fields for anime details. Modify as needed.
+        self.detail_fields = "id,title,alternative_titles,main_picture,start_date,end_date,mean,num_episodes,start_season,status"
+
+        # Anime detail requests in flight, by id.
+        self._flights = {}
+
+        # URLs MAL last answered with a 404, newest last, so callers can tell
+        # "doesn't exist" from "couldn't be reached".
+        self._not_found = OrderedDict()
+        self._not_found_cap = 1024
+
+        # Callbacks given every anime node seen in a response.
+        self._listeners = []
+
+        # Connection pool settings. The session itself is created lazily
+        # since aiohttp wants to be set up inside a running event loop.
+        self.connection_limit = connection_limit
+        self.per_host_limit = per_host_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self._session = None
+
+        # Every request waits its turn here so bursts don't get us throttled.
+        # rate_bucket replaces the in-process token bucket, e.g. with a
+        # SharedTokenBucket when several processes share one MAL client ID.
+        self.scheduler = RequestScheduler(rate=rate, burst=burst, max_concurrent=max_concurrent,
+                                          bucket=rate_bucket)
+
+        # Failure handling. Interactive requests give up after `deadline`
+        # seconds, queueing and retries included. Timeouts, connection
+        # errors, 5xx and throttling are retried up to `retries` times with
+        # jittered exponential backoff. If an interactive request hasn't
+        # answered after `hedge_after` seconds a duplicate is sent and the
+        # first good answer wins (None turns hedging off).
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_after = hedge_after
+
+        # Fails requests at once while MAL looks down; callers fall back to
+        # cached data where there is some.
+        self.breaker = CircuitBreaker(failure_threshold=breaker_threshold, reset_timeout=breaker_reset)
+
+        # Response cache, with lifetimes in seconds per endpoint.
+        self.cache = ResponseCache(max_entries=cache_entries)
+        self.cache_ttls = {'search': 600,
+                           'anime': 3600,
+                           'anime_finished': 6 * 3600,
+                           'ranking': 1800,
+                           'ranking_airing': 300,
+                           'season': 1800,
+                           'user_list': 120}
+
+        # Optional MetadataStore behind the memory cache.
+        self.store = store
 
     # Returns id, name, and cover pictures of shows found in the query.
-    def getAnime(self, search_query="", limit="100", offset="0"):
+    async def getAnime(self, search_query="", limit="100", offset="0"):
         # Numeric argument check.
         if self._checkNumericArgs(limit, offset) == False:
             return False
         
-        # Limit cap.
-        if int(limit) >= self.limit_cap:
-            limit = self.limit_cap
-        
         # Prepare request parts and send.
-        url = "https://api.myanimelist.net/v2/anime"
-        parameters = {}
-        parameters["q"]      = str(search_query)
-        parameters["limit"]  = str(limit)
-        parameters["offset"] = str(offset)
-        response = self._sendRequest(url, parameters)
+        url, parameters = self.searchRequest(search_query, limit, offset)
+        response = await self._cachedRequest(url, parameters, self.cache_ttls['search'], parseNodeList)
 
         # Request failed.
         if response == False:
             return False
 
-        # Extract each show found.
-        response = response.json()
-        formatted_response = []
-        for anime in response["data"]:
-            formatted_response.append(anime["node"])
-        return formatted_response
+        records = response[0]
+        self._notify(records)
+        return records
     
+    # URL and parameters getAnime sends, limit capped.
+    def searchRequest(self, search_query="", limit="100", offset="0"):
+        if int(limit) >= self.limit_cap:
+            limit = self.limit_cap
+        url = self.base_url + "/anime"
+        parameters = {}
+        parameters["q"]      = str(search_query)
+        parameters["fields"] = self.list_fields
+        parameters["limit"]  = str(limit)
+        parameters["offset"] = str(offset)
+        return url, parameters
+
     # Returns specific anime by ID given.
     # Pass fields to narrow results.
-    def getAnimeByID(self, anime_id, fields=""):
-        # Numeric argument check.
+    async def getAnimeByID(self, anime_id, fields=""):
+        # Numeric argument check. Unlike limits and offsets the ID can't be
+        # left empty, and has to be plain digits.
         if self._checkNumericArgs(anime_id) == False:
             return False
+        if str(anime_id).isdecimal() == False:
+            self._writeToLog(f"({anime_id}) is not a valid anime ID.")
+            return False
         
-        # Default fields to return. Modify as needed.
-        if fields == "":
-            fields="id,title,main_picture,start_date,end_date,mean,num_episodes,start_season"
-        
-        # Prepare request parts and send.
-        url = "https://api.myanimelist.net/v2/anime/" + str(anime_id)
-        parameters = {}
-        parameters["fields"] = str(fields)
-        response = self._sendRequest(url, parameters)
+        # Prepare request parts and send. Concurrent lookups of the same
+        # anime share one request.
+        fields = fields or self.detail_fields
+        key = self._detailKey(anime_id, fields)
+        response = await self._readCache(key, lambda: self._coalescedDetails(anime_id, fields), self._animeTTL)
 
         # Request failed.
         if response == False:
             return False
         
-        response = response.json()
+        self._notify([response])
         return response
+
+    # Returns specific anime for each ID given, in order (False for any
+    # that failed). At most `concurrency` lookups run at once.
+    async def getAnimeByIDs(self, anime_ids, fields="", concurrency=8):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(anime_id):
+            async with semaphore:
+                return await self.getAnimeByID(anime_id, fields)
+
+        return await asyncio.gather(*(fetch(anime_id) for anime_id in anime_ids))
+
+    # Generation of the cached response for a request, as built by
+    # searchRequest or rankingRequest. Changes whenever it's refreshed.
+    def dataVersion(self, url, parameters):
+        return self.cache.generation(ResponseCache.makeKey(url, parameters))
+
+    # True if the last failed getAnimeByID for this ID was a 404, as
+    # opposed to a timeout, server error, throttling or open circuit.
+    def isNotFound(self, anime_id):
+        return (self.base_url + "/anime/" + str(anime_id)) in self._not_found
+
+    # True if getAnimeByID would be answered from memory right now.
+    def hasAnimeDetails(self, anime_id, fields=""):
+        return self.cache.peek(self._detailKey(anime_id, fields or self.detail_fields)) is not None
+
+    def _detailKey(self, anime_id, fields):
+        return ResponseCache.makeKey(self.base_url + "/anime/" + str(anime_id), {"fields": str(fields)})
+
+    # Single-flight for anime details. Callers arriving in the same loop
+    # tick are merged into one request for the union of their fields;
+    # later callers join a request already sent if it covers their fields.
+    # The request runs with its starter's priority, deadline and hedging,
+    # so interactive callers never join a background request.
+    async def _coalescedDetails(self, anime_id, fields):
+        anime_id = int(anime_id)
+        wanted = set(fields.split(","))
+        priority = request_priority.get()
+        flight = self._flights.get(anime_id)
+        if (flight is None or (flight['sent'] and not wanted <= flight['fields'])
+                or (priority == INTERACTIVE and flight['priority'] != INTERACTIVE)):
+            flight = {'fields': set(), 'sent': False, 'priority': priority}
+            flight['task'] = asyncio.ensure_future(self._flyDetails(anime_id, flight))
+            self._flights[anime_id] = flight
+        if not flight['sent']:
+            flight['fields'] |= wanted
+        return await asyncio.shield(flight['task'])
+
+    async def _flyDetails(self, anime_id, flight):
+        try:
+            await asyncio.sleep(0)  # Let concurrent callers add their fields.
+            flight['sent'] = True
+            url = self.base_url + "/anime/" + str(anime_id)
+            parameters = {"fields": ",".join(sorted(flight['fields']))}
+            return await self._loadThroughStore(ResponseCache.makeKey(url, parameters),
+                                                url, parameters, self._animeTTL, parseAnime)
+        finally:
+            if self._flights.get(anime_id) is flight:
+                del self._flights[anime_id]
     
     # Get a list of the current anime rankings by ranking_type.
-    def getAnimeRanking(self, ranking_type, limit="100", offset="0"):
+    async def getAnimeRanking(self, ranking_type, limit="100", offset="0"):
         # Numeric argument check.
         if self._checkNumericArgs(limit, offset) == False:
             return False
@@ -85,33 +232,53 @@ class malAPI:
             self._writeToLog("Invalid ranking type.")
             return False
         
-        # Limit cap.
+        # Prepare request parts and send.
+        url, parameters = self.rankingRequest(ranking_type, limit, offset)
+        ttl = self.cache_ttls['ranking_airing' if ranking_type == "airing" else 'ranking']
+        response = await self._cachedRequest(url, parameters, ttl, parseRanking)
+
+        # Request failed.
+        if response == False:
+            return False
+
+        records = response[0]
+        self._notify(records)
+        return records
+    
+    # URL and parameters getAnimeRanking sends, limit capped.
+    def rankingRequest(self, ranking_type, limit="100", offset="0"):
         if int(limit) >= self.limit_cap:
             limit = self.limit_cap
-        
-        # Prepare request parts and send.
-        url = "https://api.myanimelist.net/v2/anime/ranking"
+        url = self.base_url + "/anime/ranking"
         parameters = {}
         parameters["ranking_type"] = str(ranking_type)
+        parameters["fields"]       = self.list_fields
         parameters["limit"]        = str(limit)
         parameters["offset"]       = str(offset)
-        response = self._sendRequest(url, parameters)
+        return url, parameters
 
-        # Request failed.
-        if response == False:
+    # Get a list of the seasonal anime specified.
+    async def getSeasonalAnime(self, year, season, sort="anime_score", limit="100", offset="0"):
+        # Numeric argument check.
+        if self._checkNumericArgs(limit) == False:
             return False
+        
+        # Limit cap.
+        if int(limit) >= self.limit_cap:
+            limit = self.limit_cap
+        
+        page = await self._seasonalPage(year, season, sort, limit, offset)
+        if page == False:
+            return False
+        return page[0]
 
-        # Extract each show found.
-        response = response.json()
-        formatted_response = []
-        for anime in response["data"]:
-            # Put the rank in with the anime data then append.
-            anime["node"]["rank"] = anime["ranking"]["rank"]
-            formatted_response.append(anime["node"])
-        return formatted_response
-    
-    # Get a list of the seasonal anime specified.
-    def getSeasonalAnime(self, year, season, sort="anime_score", limit="100", offset="0"):
+    # Yields every anime in the season, fetching pages only as they're consumed.
+    async def iterSeasonalAnime(self, year, season, sort="anime_score", page_size=100, prefetch=1):
+        async for anime in self._paginate(self._seasonalPage, (year, season, sort), page_size, prefetch):
+            yield anime
+
+    # Fetches one page of seasonal anime. Returns (anime, has_next), False on fail.
+    async def _seasonalPage(self, year, season, sort, limit, offset):
         # Numeric argument check.
         if self._checkNumericArgs(year, limit, offset) == False:
             return False
@@ -127,39 +294,48 @@ class malAPI:
             self._writeToLog("Invalid sort type.")
             return False
         
-        # Limit cap.
-        if int(limit) >= self.limit_cap:
-            limit = self.limit_cap
-        
         # Prepare request parts and send.
-        url = "https://api.myanimelist.net/v2/anime/season/" + str(year) + "/" + str(season).lower()
+        url = self.base_url + "/anime/season/" + str(year) + "/" + str(season).lower()
         parameters = {}
         parameters["sort"]   = str(sort)
+        parameters["fields"] = self.list_fields
         parameters["limit"]  = str(limit)
         parameters["offset"] = str(offset)
-        response = self._sendRequest(url, parameters)
+        response = await self._cachedRequest(url, parameters, self.cache_ttls['season'], parseNodeList)
 
         # Request failed.
         if response == False:
             return False
 
-        # Extract each show found.
-        response = response.json()
-        formatted_response = []
-        for anime in response["data"]:
-            formatted_response.append(anime["node"])
-        return formatted_response
+        self._notify(response[0])
+        return response
     
     # Get a specified user's anime list.
-    def getUserAnimeList(self, user_name, status="", sort="anime_title", limit="100", offset="0"):
+    async def getUserAnimeList(self, user_name, status="", sort="anime_title", limit="100", offset="0"):
         # Numeric argument check.
-        if self._checkNumericArgs(limit, offset) == False:
+        if self._checkNumericArgs(limit) == False:
             return False
         
         # Limit cap.
         if int(limit) >= self.limit_cap:
             limit = self.limit_cap
         
+        page = await self._userListPage(user_name, status, sort, limit, offset)
+        if page == False:
+            return False
+        return page[0]
+
+    # Yields a user's whole list, fetching pages only as they're consumed.
+    async def iterUserAnimeList(self, user_name, status="", sort="anime_title", page_size=100, prefetch=1):
+        async for anime in self._paginate(self._userListPage, (user_name, status, sort), page_size, prefetch):
+            yield anime
+
+    # Fetches one page of a user's list. Returns (anime, has_next), False on fail.
+    async def _userListPage(self, user_name, status, sort, limit, offset):
+        # Numeric argument check.
+        if self._checkNumericArgs(limit, offset) == False:
+            return False
+        
         # Check status.
         if status != "":
             status_types = ["watching", "completed", "on_hold", "dropped", "plan_to_watch"]
@@ -174,51 +350,383 @@ class malAPI:
             return False
         
         # Prepare request parts and send.
-        url = "https://api.myanimelist.net/v2/users/" + str(user_name) + "/animelist"
+        url = self.base_url + "/users/" + str(user_name) + "/animelist"
         parameters = {}
         parameters["fields"] = "list_status"
         parameters["status"] = str(status)
         parameters["sort"]   = str(sort)
         parameters["limit"]  = str(limit)
         parameters["offset"] = str(offset)
-        response = self._sendRequest(url, parameters)
+        response = await self._cachedRequest(url, parameters, self.cache_ttls['user_list'], parseUserList)
 
         # Request failed.
         if response == False:
             return False
-        
-        # Extract each show found.
-        response = response.json()
-        formatted_response = []
-        for anime in response["data"]:
-            # Merge anime info with list info.
-            anime_info = anime["node"]
-            anime_info["score"]      = anime["list_status"]["score"]
-            anime_info["status"]     = anime["list_status"]["status"]
-            anime_info["updated_at"] = anime["list_status"]["updated_at"]
-            formatted_response.append(anime_info)      
-        return formatted_response
+
+        # List entries carry the user's score and status in list_score and
+        # list_status; the anime's own fields are left alone.
+        self._notify(response[0])
+        return response
+
+    # Fetches one page of a user's list, most recently updated first,
+    # straight from MAL. The caches are neither read nor written, so pollers
+    # always see the latest and don't fill them with pages nobody else
+    # reads. Returns (anime, has_next), False on fail.
+    async def pollUserAnimeList(self, user_name, limit=10, offset=0):
+        # Numeric argument check.
+        if self._checkNumericArgs(limit, offset) == False:
+            return False
+
+        url = self.base_url + "/users/" + str(user_name) + "/animelist"
+        parameters = {}
+        parameters["fields"] = "list_status"
+        parameters["status"] = ""
+        parameters["sort"]   = "list_updated_at"
+        parameters["limit"]  = str(min(int(limit), self.page_size_cap))
+        parameters["offset"] = str(offset)
+        response = await self._sendRequest(url, parameters)
+
+        # Request failed.
+        if response == False:
+            return False
+        response = self._parse(parseUserList, response, url)
+        if response == False:
+            return False
+
+        self._notify(response[0])
+        return response
+
+    # Walks a paged endpoint with offset paging, yielding entries in order.
+    # Offsets are known up front, so up to `prefetch` pages past the one
+    # being consumed are kept in flight. With prefetch=0 a page is only
+    # requested once the consumer reaches it. A failed page raises
+    # PaginationError, after whatever came before it has been yielded.
+    async def _paginate(self, fetch_page, args, page_size, prefetch):
+        page_size = min(int(page_size), self.page_size_cap)
+        pending = deque()
+        offset = 0
+
+        def schedule():
+            nonlocal offset
+            pending.append(asyncio.ensure_future(fetch_page(*args, page_size, offset)))
+            offset += page_size
+
+        has_next = True
+        try:
+            while has_next:
+                if len(pending) == 0:
+                    schedule()
+                page = await pending.popleft()
+                if page == False:
+                    raise PaginationError(f"Failed to fetch a page of {fetch_page.__name__}{args}.")
+                entries, has_next = page
+                if has_next:
+                    while len(pending) < prefetch:
+                        schedule()
+                for entry in entries:
+                    yield entry
+        finally:
+            for task in pending:
+                task.cancel()
     
-    # Returns response on success, False on fail.
-    def _sendRequest(self, url, parameters):
-        r = requests.get(url, parameters, headers=self.client_auth)
-        # Error handling.
-        response_json = r.json()
-        if r.status_code != 200:
-            error_msg = f"{r.status_code}: {response_json['error']}\n"
-            error_msg += f"URL: {url}\n"
-            error_msg += f"Parameters: {parameters}\n"
-            self._writeToLog(error_msg)
-            return False
-        return r
+    # Returns the pooled session, creating it on first use.
+    def _getSession(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connection_limit,
+                                             limit_per_host=self.per_host_limit,
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=self.timeout,
+                                                  headers=self.client_auth)
+        return self._session
+
+    # Closes the pooled session and flushes the log. Call on shutdown.
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        await asyncio.to_thread(self.logger.close)
+
+    # Registers fn(records), called with the anime found in every response.
+    # stored=False skips records warmStart loads back from the store, for
+    # listeners (like the store itself) that already have them.
+    def addListener(self, fn, stored=True):
+        self._listeners.append((fn, stored))
+
+    def _notify(self, records, stored=False):
+        for fn, wants_stored in self._listeners:
+            if wants_stored or not stored:
+                fn(records)
+
+    # Sends the request through the response cache, then the store. The
+    # memory cache holds parsed records; the store keeps the raw JSON.
+    async def _cachedRequest(self, url, parameters, ttl, parse):
+        key = ResponseCache.makeKey(url, parameters)
+        return await self._readCache(key, lambda: self._loadThroughStore(key, url, parameters, ttl, parse), ttl)
+
+    # Gets key through the memory cache. An answer that didn't have to be
+    # loaded (fresh or stale) counts as a read of the stored response.
+    async def _readCache(self, key, loader, ttl):
+        loaded = False
+
+        def load():
+            nonlocal loaded
+            loaded = True
+            return loader()
+
+        response = await self.cache.get(key, load, ttl)
+        if not loaded and response != False:
+            self._touch(key)
+        return response
+
+    # Marks a stored response as read, if a user asked for it. Background
+    # reads (crawlers, prefetching, refreshes) don't keep anything warm.
+    def _touch(self, key):
+        if self.store is not None and request_priority.get() == INTERACTIVE:
+            self.store.touchSnapshot(self.store.snapshotKey(key))
+
+    # Returns a fresh stored response if there is one, otherwise fetches
+    # from MAL and writes the result back. Either way it's parsed on the way out.
+    # If MAL can't be reached an expired stored response is better than nothing.
+    async def _loadThroughStore(self, key, url, parameters, ttl, parse):
+        stale = None
+        if self.store is not None:
+            store_key = self.store.snapshotKey(key)
+            snapshot = self.store.getSnapshot(store_key)
+            if snapshot is not None:
+                data, fetched_at, stored_ttl = snapshot
+                if time.time() < fetched_at + stored_ttl:
+                    self._touch(key)
+                    return self._parse(parse, data, url)
+                stale = data
+
+        response = await self._sendRequest(url, parameters)
+        if response == False:
+            if stale is not None:
+                return self._parse(parse, stale, url)
+            return False
+        parsed = self._parse(parse, response, url)
+        if parsed != False and self.store is not None:
+            if callable(ttl):
+                ttl = ttl(parsed)
+            self.store.putSnapshot(store_key, url, parameters, response, ttl)
+        return parsed
+
+    # Re-fetches a stored response and updates the store and cache.
+    async def refreshSnapshot(self, url, parameters, ttl):
+        response = await self._sendRequest(url, parameters)
+        if response == False:
+            return False
+        parsed = self._parse(self._parserFor(url), response, url)
+        if parsed == False:
+            return False
+        key = ResponseCache.makeKey(url, parameters)
+        self.cache.put(key, parsed, ttl)
+        if self.store is not None:
+            self.store.putSnapshot(self.store.snapshotKey(key), url, parameters, response, ttl)
+        return parsed
+
+    # Loads the store's working set: the most recently fetched anime go to
+    # the listeners (catalog, search index, schedule), recent snapshots go
+    # into the memory cache. Stale ones are still served once while they
+    # refresh in the background.
+    async def warmStart(self, max_anime=20000, max_snapshots=2000, chunk=500):
+        if self.store is None:
+            return 0, 0
+        nodes, snapshots = await asyncio.to_thread(self.store.loadWorkingSet, max_anime, max_snapshots)
+        # Done in chunks, yielding in between, since this can run while the
+        # bot is already answering commands.
+        for i in range(0, len(nodes), chunk):
+            self._notify([AnimeRecord.fromNode(node) for node in nodes[i:i + chunk]], stored=True)
+            await asyncio.sleep(0)
+        now = time.time()
+        for i, (_, url, parameters, data, fetched_at, ttl) in enumerate(snapshots):
+            if i % chunk == chunk - 1:
+                await asyncio.sleep(0)
+            parsed = self._parse(self._parserFor(url), data, url)
+            if parsed == False:
+                continue
+            remaining = max(fetched_at + ttl - now, 0)
+            self.cache.put(ResponseCache.makeKey(url, parameters), parsed, remaining, ttl)
+        return len(nodes), len(snapshots)
+
+    # Picks the response parser for a MAL URL.
+    def _parserFor(self, url):
+        endpoint = metrics.endpointLabel(url)
+        if endpoint == "/v2/anime/{id}":
+            return parseAnime
+        if endpoint == "/v2/anime/ranking":
+            return parseRanking
+        if endpoint == "/v2/users/{user}/animelist":
+            return parseUserList
+        return parseNodeList
+
+    # Runs a parser, logging and returning False if the JSON isn't shaped
+    # the way it expects.
+    def _parse(self, parse, data, url):
+        try:
+            return parse(data)
+        except (KeyError, TypeError, ValueError) as e:
+            self._writeToLog(f"Unexpected response from {url}: {type(e).__name__}: {e}")
+            return False
+
+    # Finished shows rarely change, so they're kept longer.
+    def _animeTTL(self, record):
+        if record.status == "finished_airing":
+            return self.cache_ttls['anime_finished']
+        return self.cache_ttls['anime']
+
+    # Sends a GET with retries. Returns decoded JSON on success, False on fail.
+    async def _sendRequest(self, url, parameters):
+        endpoint = metrics.endpointLabel(url)
+        interactive = request_priority.get() == INTERACTIVE
+        deadline = time.monotonic() + self.deadline if interactive and self.deadline else None
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                metrics.mal_responses.inc(status="circuit_open")
+                return False
+            probe = self.breaker.state == HALF_OPEN
+
+            # Set once an attempt gets past the scheduler, so a deadline
+            # that passes in the local queue isn't blamed on MAL.
+            sent = []
+            try:
+                if deadline is None:
+                    status, response_json, outcome = await self._hedgedAttempt(url, parameters, endpoint, False, sent)
+                else:
+                    status, response_json, outcome = await asyncio.wait_for(
+                        self._hedgedAttempt(url, parameters, endpoint, interactive, sent),
+                        max(deadline - time.monotonic(), 0.0))
+            except asyncio.TimeoutError:
+                metrics.mal_responses.inc(status="deadline" if sent else "deadline_queued")
+                self._writeToLog(f"Deadline of {self.deadline}s passed for {url}"
+                                 + ("." if sent else " while queued."))
+                status, response_json, outcome = None, None, SERVER_ERROR if sent else QUEUED
+            except asyncio.CancelledError:
+                # The caller gave up; free the half-open probe if this was it.
+                if probe:
+                    self.breaker.release()
+                raise
+
+            if outcome == OK:
+                self.breaker.recordSuccess()
+                return response_json
+            if outcome == QUEUED:
+                if probe:
+                    self.breaker.release()
+                return False
+            if outcome == SERVER_ERROR:
+                self.breaker.recordFailure()
+            else:
+                self.breaker.recordSuccess()  # MAL answered, it's just a no.
+            if outcome == CLIENT_ERROR or attempt >= self.retries:
+                return False
+
+            # Full jitter: anywhere from 0 to the exponential cap.
+            delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                return False
+            metrics.mal_retries.inc(endpoint=endpoint)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # One attempt, plus a duplicate if hedging is on and the first is slow.
+    # Returns the first good result, or the last failure if both fail.
+    async def _hedgedAttempt(self, url, parameters, endpoint, hedge, sent):
+        if not hedge or self.hedge_after is None:
+            return await self._attempt(url, parameters, endpoint, sent)
+
+        tasks = {asyncio.ensure_future(self._attempt(url, parameters, endpoint, sent))}
+        try:
+            done, tasks = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if done:
+                return done.pop().result()
+            metrics.mal_hedges.inc(endpoint=endpoint)
+            tasks.add(asyncio.ensure_future(self._attempt(url, parameters, endpoint, sent)))
+            result = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result[2] == OK:
+                        return result
+            return result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # Sends the request once. The status is checked before the body is
+    # decoded, so HTML error pages are handled like any other error.
+    # Returns (status, decoded JSON or None, outcome). Appends to sent
+    # once the request is on its way.
+    async def _attempt(self, url, parameters, endpoint, sent):
+        session = self._getSession()
+        queued_at = time.perf_counter()
+        sent_at = queued_at
+        try:
+            async with self.scheduler.slot():
+                sent.append(True)
+                sent_at = time.perf_counter()
+                metrics.mal_wait.observe(sent_at - queued_at, endpoint=endpoint)
+                metrics.mal_in_flight.inc()
+                try:
+                    async with session.get(url, params=parameters) as r:
+                        status = r.status
+                        body = await r.read()
+                finally:
+                    metrics.mal_in_flight.dec()
+                    metrics.mal_latency.observe(time.perf_counter() - sent_at, endpoint=endpoint)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            metrics.mal_responses.inc(status=type(e).__name__)
+            self._logRequest(f"{type(e).__name__}: {e}", url, parameters, None, queued_at, sent_at)
+            return None, None, SERVER_ERROR
+        metrics.mal_responses.inc(status=str(status))
+
+        if status == 200:
+            try:
+                response_json = json.loads(body)
+            except ValueError as e:
+                self._logRequest(f"Bad JSON: {e}", url, parameters, status, queued_at, sent_at)
+                return status, None, SERVER_ERROR
+            if self.log_requests:
+                self._logRequest("ok", url, parameters, status, queued_at, sent_at, level="info")
+            self._not_found.pop(url, None)
+            return status, response_json, OK
+
+        # Error handling. MAL's errors are JSON, proxies' are often HTML.
+        error = 'unknown'
+        try:
+            response_json = json.loads(body)
+            if isinstance(response_json, dict):
+                error = response_json.get('error', 'unknown')
+        except ValueError:
+            pass
+        self._logRequest(error, url, parameters, status, queued_at, sent_at)
+        if status == 429 or status == 403:
+            self.scheduler.backoff()
+            return status, None, THROTTLED
+        if status >= 500:
+            return status, None, SERVER_ERROR
+        if status == 404:
+            self._not_found[url] = True
+            self._not_found.move_to_end(url)
+            while len(self._not_found) > self._not_found_cap:
+                self._not_found.popitem(last=False)
+        return status, None, CLIENT_ERROR
+
+    # Queues a structured record for one request.
+    def _logRequest(self, msg, url, parameters, status, queued_at, sent_at, level="error"):
+        now = time.perf_counter()
+        self.logger.log(msg, level=level, url=url, params=parameters, status=status,
+                        latency_ms=round((now - sent_at) * 1000, 1),
+                        wait_ms=round((sent_at - queued_at) * 1000, 1))
     
     # Writes error message to log file.
     def _writeToLog(self, *msgs):
-        now = datetime.now()
-        now = now.strftime("%Y/%m/%d %H:%M:%S")
-        with open(self.log_file, "a") as log:
-            for msg in msgs:
-                log.write(f"[{now}] {msg}\n")
+        for msg in msgs:
+            self.logger.log(msg)
 
     # Checks that numeric arguments are numbers.
     def _checkNumericArgs(self, *args):
@@ -0,0 +1,109 @@
+# messageRenderer.py
+# Turns command results into Discord embeds, split into pages that fit
+# Discord's limits, and caches what's been rendered. Builders collect
+# lines and join them once per page, so rendering stays linear in the
+# size of the result.
+import time
+from collections import OrderedDict
+from discord import Embed
+
+# Discord's limits on embed text.
+TITLE_LIMIT = 256
+DESCRIPTION_LIMIT = 4096
+FOOTER_LIMIT = 2048
+
+# Splits lines into page texts of at most limit characters. A line that
+# is too long on its own is cut short.
+def paginate(lines, limit=DESCRIPTION_LIMIT):
+    pages = []
+    page = []
+    size = 0
+    for line in lines:
+        if len(line) > limit:
+            line = line[:limit - 3] + "..."
+        # +1 for the newline joining it to the previous line.
+        if page and size + 1 + len(line) > limit:
+            pages.append("\n".join(page))
+            page = []
+            size = 0
+        size += len(line) + (1 if page else 0)
+        page.append(line)
+    if page or not pages:
+        pages.append("\n".join(page))
+    return pages
+
+# Returns a list of embeds holding the lines under one title. Footers
+# number the pages when there's more than one, after an optional footer
+# line of their own.
+def listEmbeds(title, lines, footer=None, empty="Nothing found."):
+    texts = paginate(lines) if lines else [empty]
+    embeds = []
+    for i, text in enumerate(texts):
+        embed = Embed(title=title[:TITLE_LIMIT], description=text)
+        page_footer = footer
+        if len(texts) > 1:
+            page_footer = f"{footer} · Page {i + 1}/{len(texts)}" if footer else f"Page {i + 1}/{len(texts)}"
+        if page_footer:
+            embed.set_footer(text=page_footer[:FOOTER_LIMIT])
+        embeds.append(embed)
+    return embeds
+
+# Sends every page of a rendered reply, the first as the response and
+# the rest as followups. At most max_pages are sent.
+async def sendPages(interaction, pages, max_pages=5, **kwargs):
+    for embed in pages[:max_pages]:
+        await interaction.send(embed=embed, **kwargs)
+
+# Rendered replies keyed by (command, normalized args). Each one carries
+# the version of the data it was rendered from and is only served while
+# the caller's current version matches, and for at most its ttl.
+class RenderCache:
+
+    def __init__(self, max_entries=512):
+        # key -> [version, rendered, expires_at], least recently used first.
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+        # Counters.
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    # Argument case and surrounding whitespace don't change the reply.
+    @staticmethod
+    def makeKey(command, args):
+        normalized = tuple(arg.strip().lower() if isinstance(arg, str) else arg for arg in args)
+        return (command, normalized)
+
+    # Returns what was rendered for these arguments, or None if nothing
+    # was or the data has changed since.
+    def get(self, command, args, version):
+        key = self.makeKey(command, args)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] == version and time.monotonic() < entry[2]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+            self.invalidated += 1
+        self.misses += 1
+        return None
+
+    def put(self, command, args, version, rendered, ttl):
+        key = self.makeKey(command, args)
+        self._entries[key] = [version, rendered, time.monotonic() + ttl]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'invalidated': self.invalidated,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries)}
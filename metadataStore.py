@@ -0,0 +1,310 @@
+# metadataStore.py
+# SQLite store for anime records, endpoint snapshots, linked MAL accounts
+# and list watch state, so the bot starts warm after a restart and only
+# refreshes what has gone stale.
+import asyncio
+import json
+import sqlite3
+import time
+from requestScheduler import BACKGROUND, setPriority
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS anime (
+    id         INTEGER PRIMARY KEY,
+    data       TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS anime_fetched ON anime (fetched_at);
+CREATE TABLE IF NOT EXISTS snapshots (
+    key         TEXT PRIMARY KEY,
+    url         TEXT NOT NULL,
+    params      TEXT NOT NULL,
+    data        TEXT NOT NULL,
+    fetched_at  REAL NOT NULL,
+    ttl         REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_access ON snapshots (last_access);
+CREATE TABLE IF NOT EXISTS links (
+    guild_id INTEGER NOT NULL,
+    user_id  INTEGER NOT NULL,
+    mal_name TEXT NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS watch_channels (
+    guild_id   INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS watch_marks (
+    mal_name   TEXT PRIMARY KEY,
+    high_water TEXT NOT NULL,
+    interval   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+class MetadataStore:
+
+    def __init__(self, path, flush_interval=2.0):
+        self.path = path
+        self.flush_interval = flush_interval
+
+        # Reads happen on the event loop (indexed point lookups), writes are
+        # batched onto a worker thread with its own connection. WAL lets the
+        # two run side by side.
+        self._reader = self._connect()
+        self._reader.executescript(SCHEMA)
+        self._writer = None
+        self._flush_lock = asyncio.Lock()
+
+        # Writes waiting for the next flush.
+        self._pending_anime = {}
+        self._pending_snapshots = {}
+        self._pending_access = {}
+        self._pending_links = {}
+        self._pending_channels = {}
+        self._pending_marks = {}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # Key used for a response cache key tuple.
+    @staticmethod
+    def snapshotKey(cache_key):
+        return json.dumps(cache_key)
+
+    # Returns (data, fetched_at, ttl) for a stored response, or None. Data
+    # read back from disk is left as JSON text for the caller's parser.
+    def getSnapshot(self, key):
+        pending = self._pending_snapshots.get(key)
+        if pending is not None:
+            return pending[2], pending[3], pending[4]
+        row = self._reader.execute("SELECT data, fetched_at, ttl FROM snapshots WHERE key = ?",
+                                   (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], row[2]
+
+    # Queues a stored response's last read time. Only reads by users count,
+    # so the sync loop leaves alone what nobody has looked at.
+    def touchSnapshot(self, key):
+        self._pending_access[key] = time.time()
+
+    # Queues a response to be written on the next flush.
+    def putSnapshot(self, key, url, parameters, data, ttl):
+        self._pending_snapshots[key] = (url, parameters, data, time.time(), ttl)
+
+    # Queues every anime in a list of AnimeRecords to be merged in.
+    def addRecords(self, records):
+        for record in records:
+            pending = self._pending_anime.setdefault(record.id, {})
+            pending.update(record.toNode())
+
+    # Small bits of bot state, like the last synced command tree hash.
+    def getMeta(self, key):
+        row = self._reader.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    # Written straight away rather than batched; only used once in a while.
+    def setMeta(self, key, value):
+        with self._reader:
+            self._reader.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                                 "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    # Queues a Discord user's MAL name for a guild. None removes the link.
+    def linkUser(self, guild_id, user_id, mal_name):
+        self._pending_links[(guild_id, user_id)] = mal_name
+
+    # Returns {discord user id: MAL name} for everyone linked in a guild.
+    def guildLinks(self, guild_id):
+        links = dict(self._reader.execute("SELECT user_id, mal_name FROM links WHERE guild_id = ?",
+                                          (guild_id,)).fetchall())
+        for (link_guild, user_id), mal_name in self._pending_links.items():
+            if link_guild != guild_id:
+                continue
+            if mal_name is None:
+                links.pop(user_id, None)
+            else:
+                links[user_id] = mal_name
+        return links
+
+    # Queues the channel a guild's list updates are posted to. None stops them.
+    def setWatchChannel(self, guild_id, channel_id):
+        self._pending_channels[guild_id] = channel_id
+
+    # Returns {lowercased MAL name: (MAL name, [channel ids])} for every
+    # linked user in a guild with a watch channel. Reads what's been flushed.
+    # owns(guild_id), if given, limits this to guilds this process serves.
+    def watchTargets(self, owns=None):
+        targets = {}
+        for guild_id, mal_name, channel_id in self._reader.execute(
+                "SELECT links.guild_id, links.mal_name, watch_channels.channel_id FROM links "
+                "JOIN watch_channels ON links.guild_id = watch_channels.guild_id"):
+            if owns is not None and not owns(guild_id):
+                continue
+            targets.setdefault(mal_name.lower(), (mal_name, []))[1].append(channel_id)
+        return targets
+
+    # Returns {lowercased MAL name: (high water mark, poll interval)}.
+    def watchMarks(self):
+        marks = {name: (high_water, interval) for name, high_water, interval
+                 in self._reader.execute("SELECT mal_name, high_water, interval FROM watch_marks")}
+        marks.update(self._pending_marks)
+        return marks
+
+    # Queues a user's newest seen list update time and current poll interval.
+    def putWatchMark(self, mal_name, high_water, interval):
+        self._pending_marks[mal_name.lower()] = (high_water, interval)
+
+    # Writes everything queued so far in one transaction. Returns False if
+    # the write failed; the batch is queued again for the next flush.
+    async def flush(self):
+        async with self._flush_lock:
+            anime, self._pending_anime = self._pending_anime, {}
+            snapshots, self._pending_snapshots = self._pending_snapshots, {}
+            access, self._pending_access = self._pending_access, {}
+            links, self._pending_links = self._pending_links, {}
+            channels, self._pending_channels = self._pending_channels, {}
+            watch_marks, self._pending_marks = self._pending_marks, {}
+            if not (anime or snapshots or access or links or channels or watch_marks):
+                return True
+            try:
+                await asyncio.to_thread(self._writeBatch, anime, snapshots, access, links, channels, watch_marks)
+            except sqlite3.Error as e:
+                print(f"Store flush failed, will retry: {e}")
+                self._requeue(anime, snapshots, access, links, channels, watch_marks)
+                return False
+            return True
+
+    # Puts a failed batch back under anything queued since, so newer
+    # writes still win.
+    def _requeue(self, anime, snapshots, access, links, channels, watch_marks):
+        for anime_id, fields in self._pending_anime.items():
+            anime.setdefault(anime_id, {}).update(fields)
+        self._pending_anime = anime
+        for failed, name in ((snapshots, '_pending_snapshots'), (access, '_pending_access'),
+                             (links, '_pending_links'), (channels, '_pending_channels'),
+                             (watch_marks, '_pending_marks')):
+            failed.update(getattr(self, name))
+            setattr(self, name, failed)
+
+    def _writeBatch(self, anime, snapshots, access, links, channels, watch_marks):
+        if self._writer is None:
+            self._writer = self._connect()
+            self._writer.isolation_level = None  # Transactions are opened explicitly below.
+        now = time.time()
+        with self._writer:
+            # Take the write lock up front so the read-merge-write below is
+            # atomic when several bot processes share the file.
+            self._writer.execute("BEGIN IMMEDIATE")
+
+            # Merge new anime fields over what's already stored.
+            if anime:
+                ids = list(anime)
+                stored = {}
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    marks = ",".join("?" * len(chunk))
+                    for anime_id, data in self._writer.execute(
+                            f"SELECT id, data FROM anime WHERE id IN ({marks})", chunk):
+                        stored[anime_id] = json.loads(data)
+                rows = []
+                for anime_id, record in anime.items():
+                    merged = stored.get(anime_id, {})
+                    merged.update(record)
+                    rows.append((anime_id, json.dumps(merged), now))
+                self._writer.executemany(
+                    "INSERT INTO anime (id, data, fetched_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET data = excluded.data, fetched_at = excluded.fetched_at",
+                    rows)
+            if snapshots:
+                self._writer.executemany(
+                    "INSERT INTO snapshots (key, url, params, data, fetched_at, ttl, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET data = excluded.data, fetched_at = excluded.fetched_at, "
+                    "ttl = excluded.ttl",
+                    [(key, url, json.dumps(params), json.dumps(data), fetched_at, ttl, fetched_at)
+                     for key, (url, params, data, fetched_at, ttl) in snapshots.items()])
+            if access:
+                self._writer.executemany("UPDATE snapshots SET last_access = ? WHERE key = ?",
+                                         [(at, key) for key, at in access.items()])
+            if links:
+                self._writer.executemany(
+                    "INSERT INTO links (guild_id, user_id, mal_name) VALUES (?, ?, ?) "
+                    "ON CONFLICT(guild_id, user_id) DO UPDATE SET mal_name = excluded.mal_name",
+                    [(guild_id, user_id, mal_name) for (guild_id, user_id), mal_name in links.items()
+                     if mal_name is not None])
+                self._writer.executemany("DELETE FROM links WHERE guild_id = ? AND user_id = ?",
+                                         [key for key, mal_name in links.items() if mal_name is None])
+            if channels:
+                self._writer.executemany(
+                    "INSERT INTO watch_channels (guild_id, channel_id) VALUES (?, ?) "
+                    "ON CONFLICT(guild_id) DO UPDATE SET channel_id = excluded.channel_id",
+                    [(guild_id, channel_id) for guild_id, channel_id in channels.items() if channel_id is not None])
+                self._writer.executemany("DELETE FROM watch_channels WHERE guild_id = ?",
+                                         [(guild_id,) for guild_id, channel_id in channels.items() if channel_id is None])
+            if watch_marks:
+                self._writer.executemany(
+                    "INSERT INTO watch_marks (mal_name, high_water, interval) VALUES (?, ?, ?) "
+                    "ON CONFLICT(mal_name) DO UPDATE SET high_water = excluded.high_water, interval = excluded.interval",
+                    [(mal_name, high_water, interval) for mal_name, (high_water, interval) in watch_marks.items()])
+
+    # Loads the most recently fetched anime and most recently used snapshots.
+    # Returns (anime nodes, [(key, url, params, data, fetched_at, ttl)]).
+    def loadWorkingSet(self, max_anime=20000, max_snapshots=2000):
+        conn = self._connect()
+        try:
+            nodes = [json.loads(data) for (data,) in conn.execute(
+                "SELECT data FROM anime ORDER BY fetched_at DESC LIMIT ?", (max_anime,))]
+            snapshots = []
+            for row in conn.execute("SELECT key, url, params, data, fetched_at, ttl FROM snapshots "
+                                    "ORDER BY last_access DESC LIMIT ?", (max_snapshots,)):
+                key, url, params, data, fetched_at, ttl = row
+                snapshots.append((key, url, json.loads(params), data, fetched_at, ttl))
+            return nodes, snapshots
+        finally:
+            conn.close()
+
+    # Returns stale snapshots read since they were fetched and within
+    # max_idle seconds, most recently read first. User lists change too
+    # often to be worth keeping warm and are left out.
+    def staleSnapshots(self, limit=20, max_idle=24 * 3600):
+        now = time.time()
+        rows = self._reader.execute("SELECT key, url, params, ttl FROM snapshots "
+                                    "WHERE fetched_at + ttl < ? AND last_access > ? "
+                                    "AND last_access > fetched_at AND url NOT LIKE '%/animelist' "
+                                    "ORDER BY last_access DESC LIMIT ?",
+                                    (now, now - max_idle, limit)).fetchall()
+        return [(key, url, json.loads(params), ttl) for key, url, params, ttl in rows]
+
+    # Background task: flushes queued writes every few seconds.
+    # Errors are logged and retried on the next round rather than ending the task.
+    async def flushLoop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Store flush loop error: {type(e).__name__}: {e}")
+
+    # Background task: re-fetches snapshots users are reading once they go stale.
+    async def syncLoop(self, api, interval=300, batch=20):
+        setPriority(BACKGROUND)
+        while True:
+            await asyncio.sleep(interval)
+            for key, url, parameters, ttl in self.staleSnapshots(batch):
+                await api.refreshSnapshot(url, parameters, ttl)
+
+    # Flushes and closes both connections.
+    async def close(self):
+        await self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._reader.close()
@@ -0,0 +1,198 @@
+# metrics.py
+# Lightweight counters, gauges and histograms with Prometheus text output.
+import asyncio
+import time
+from aiohttp import web
+from bisect import bisect_left
+
+# Default latency buckets in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _labelText(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+class Counter:
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}  # label tuple -> count
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_labelText(key)} {value}")
+        return lines
+
+class Gauge:
+
+    def __init__(self, name, help_text, getter=None):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        # Optional function returning {label tuple: value}, read at render.
+        self.getter = getter
+
+    def set(self, value, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def collect(self):
+        if self.getter is not None:
+            return self.getter()
+        return self.values
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in self.collect().items():
+            lines.append(f"{self.name}{_labelText(key)} {value}")
+        return lines
+
+class Histogram:
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}  # label tuple -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    # Estimates a quantile by interpolating inside the matching bucket.
+    def quantile(self, q, **labels):
+        series = self.series.get(tuple(sorted(labels.items())))
+        if series is None:
+            return None
+        counts = series[:-1]
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def count(self, **labels):
+        series = self.series.get(tuple(sorted(labels.items())))
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labelText(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labelText(key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labelText(key)} {cumulative}")
+        return lines
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help_text):
+        return self._add(Counter(name, help_text))
+
+    def gauge(self, name, help_text, getter=None):
+        return self._add(Gauge(name, help_text, getter))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    # Prometheus text exposition format.
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# Process-wide registry and the bot's metrics.
+REGISTRY = Registry()
+command_latency = REGISTRY.histogram("bot_command_seconds", "Slash command latency.")
+command_errors = REGISTRY.counter("bot_command_errors_total", "Slash commands that raised.")
+command_defers = REGISTRY.counter("bot_command_defers_total", "Interactions deferred by the command runner.")
+mal_latency = REGISTRY.histogram("mal_request_seconds", "MAL request latency, excluding queueing.")
+mal_wait = REGISTRY.histogram("mal_queue_wait_seconds", "Time MAL requests spent waiting for the rate limiter.")
+mal_responses = REGISTRY.counter("mal_responses_total", "MAL responses by status code.")
+mal_in_flight = REGISTRY.gauge("mal_requests_in_flight", "MAL requests currently in flight.")
+mal_retries = REGISTRY.counter("mal_retries_total", "MAL requests retried after a retryable failure.")
+mal_hedges = REGISTRY.counter("mal_hedges_total", "Duplicate MAL requests sent for slow interactive ones.")
+prefetch_fetches = REGISTRY.counter("prefetch_fetches_total", "Anime details and covers fetched ahead of a lookup.")
+prefetch_lookups = REGISTRY.counter("prefetch_lookups_total", "Anime lookups after a list command, by whether a prefetch warmed them.")
+loop_lag = REGISTRY.gauge("event_loop_lag_seconds", "Last measured event loop lag.")
+loop_lag_hist = REGISTRY.histogram("event_loop_lag_hist_seconds", "Event loop lag.",
+                                   (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+# Reduces a MAL URL to a low-cardinality endpoint label.
+def endpointLabel(url):
+    path = url.split("://", 1)[-1].split("/", 1)[-1].split("?", 1)[0]
+    parts = path.split("/")
+    if len(parts) >= 3 and parts[1] == "users":
+        return "/v2/users/{user}/animelist"
+    if len(parts) >= 3 and parts[2] == "season":
+        return "/v2/anime/season"
+    if len(parts) >= 3 and parts[2].isnumeric():
+        return "/v2/anime/{id}"
+    return "/" + path
+
+# Exposes cache-style stats() dicts as gauges (hit ratio, entries, ...).
+def addStatsGauge(name, help_text, sources):
+    def collect():
+        values = {}
+        for source_name, source in sources.items():
+            for key, value in source.stats().items():
+                if isinstance(value, (int, float)):
+                    values[(('cache', source_name), ('stat', key))] = value
+        return values
+    return REGISTRY.gauge(name, help_text, collect)
+
+# Background task: measures how late the loop wakes up from a sleep.
+async def loopLagMonitor(interval=0.5):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(time.perf_counter() - start - interval, 0.0)
+        loop_lag.set(lag)
+        loop_lag_hist.observe(lag)
+
+# Serves REGISTRY on http://host:port/metrics. Returns the runner so the
+# caller can clean it up on shutdown.
+async def startServer(port, host="127.0.0.1"):
+    async def handle(request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,145 @@
+# prefetcher.py
+# After a list command, users usually look one of the listed shows up
+# with /animebyid. The prefetcher warms the details and cover of the top
+# few listed IDs in the background so that lookup is answered from cache.
+# It runs at background priority and only spends spare rate-limit tokens:
+# nothing while interactive requests are queued, never the last few
+# tokens in the bucket, and no more than its own per-minute budget.
+import asyncio
+import metrics
+import time
+from collections import OrderedDict, deque
+from requestScheduler import BACKGROUND, TokenBucket, setPriority
+
+class Prefetcher:
+
+    def __init__(self, api, covers, top_n=5, per_minute=20, reserve_tokens=2,
+                 max_queued=100, warm_window=900, max_tracked=1000, batch_size=4):
+        self.api = api
+        self.covers = covers
+
+        # How many IDs from the top of each list are queued.
+        self.top_n = top_n
+        # Prefetch's own budget of MAL requests, on top of the spare-token rule.
+        self.budget = TokenBucket(per_minute / 60, top_n)
+        # Tokens left for interactive requests.
+        self.reserve_tokens = reserve_tokens
+
+        # IDs waiting to be warmed, newest lists first. Older entries are
+        # dropped when the queue is full since they're least likely to be
+        # looked up.
+        self._queue = deque(maxlen=max_queued)
+        self._queued = set()
+        self._wake = asyncio.Event()
+        # IDs warmed together per round.
+        self.batch_size = batch_size
+
+        # IDs warmed by a prefetch and when, oldest first. A lookup within
+        # warm_window seconds counts as a prefetch hit.
+        self.warm_window = warm_window
+        self.max_tracked = max_tracked
+        self._warmed = OrderedDict()
+
+        # Counters.
+        self.queued = 0
+        self.fetched = 0
+        self.skipped = 0
+        self.lookups = 0
+        self.hits = 0
+
+    # Queues the first top_n of a list command's anime IDs.
+    def queue(self, anime_ids):
+        for anime_id in reversed(list(anime_ids)[:self.top_n]):
+            anime_id = int(anime_id)
+            if anime_id in self._queued:
+                continue
+            if len(self._queue) == self._queue.maxlen:
+                self._queued.discard(self._queue.pop())
+            self._queue.appendleft(anime_id)
+            self._queued.add(anime_id)
+            self.queued += 1
+        self._wake.set()
+
+    # Called on every /animebyid lookup to track the hit rate.
+    def recordLookup(self, anime_id):
+        try:
+            anime_id = int(anime_id)
+        except ValueError:
+            return
+        self.lookups += 1
+        warmed_at = self._warmed.pop(anime_id, None)
+        hit = warmed_at is not None and time.time() - warmed_at <= self.warm_window
+        if hit:
+            self.hits += 1
+        metrics.prefetch_lookups.inc(result="hit" if hit else "miss")
+
+    # True if a background request can go out without taking from
+    # interactive ones.
+    def _spare(self):
+        scheduler = self.api.scheduler.stats()
+        return (scheduler['queue_depth']['interactive'] == 0
+                and scheduler['tokens'] >= self.reserve_tokens + 1)
+
+    # Waits until a MAL request fits the budget.
+    async def _waitForBudget(self):
+        while True:
+            delay = self.budget.take()
+            if delay == 0:
+                break
+            await asyncio.sleep(delay)
+        while not self._spare():
+            await asyncio.sleep(0.5)
+
+    # Warms a batch of anime's details and covers. Details that aren't
+    # cached yet each wait for budget, then go out together through
+    # getAnimeByIDs. Returns how many anime had anything fetched.
+    async def warm(self, anime_ids):
+        fetched = set()
+        for anime_id in anime_ids:
+            if not self.api.hasAnimeDetails(anime_id):
+                await self._waitForBudget()
+                metrics.prefetch_fetches.inc(kind="details")
+                fetched.add(anime_id)
+        records = await self.api.getAnimeByIDs(anime_ids, concurrency=len(anime_ids))
+
+        # Covers come from MAL's CDN, not the API, so they cost no tokens.
+        for anime_id, record in zip(anime_ids, records):
+            if record == False:
+                continue
+            url = record.picture
+            if url and not self.covers.has(url):
+                metrics.prefetch_fetches.inc(kind="cover")
+                fetched.add(anime_id)
+                if await self.covers.getBytes(url) == False:
+                    continue
+            self._warmed[anime_id] = time.time()
+            self._warmed.move_to_end(anime_id)
+        while len(self._warmed) > self.max_tracked:
+            self._warmed.popitem(last=False)
+        return len(fetched)
+
+    # Background task: warms queued IDs a few at a time.
+    async def prefetchLoop(self):
+        setPriority(BACKGROUND)
+        while True:
+            if not self._queue:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                anime_id = self._queue.popleft()
+                self._queued.discard(anime_id)
+                batch.append(anime_id)
+            fetched = await self.warm(batch)
+            self.fetched += fetched
+            self.skipped += len(batch) - fetched
+
+    def stats(self):
+        return {'queued': self.queued,
+                'pending': len(self._queue),
+                'fetched': self.fetched,
+                'skipped': self.skipped,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_ratio': self.hits / self.lookups if self.lookups else 0.0}
@@ -0,0 +1,157 @@
+# requestScheduler.py
+# Token-bucket rate limiter with priority queueing for outbound MAL requests.
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+# Priorities, lowest value served first.
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Priority of requests made from the current task. Slash commands use the
+# default; background loops call setPriority(BACKGROUND) once at the top.
+request_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+def setPriority(priority):
+    request_priority.set(priority)
+
+# In-process token bucket: rate tokens per second, holding at most burst.
+# SharedTokenBucket (sharedRateLimit.py) has the same interface for
+# sharing one budget between processes.
+class TokenBucket:
+
+    def __init__(self, rate=2.0, burst=5):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+
+        # No tokens are handed out before this time (set after a 429/403).
+        self._paused_until = 0.0
+
+    # Takes a token if one is free. Returns 0 on success, otherwise the
+    # seconds until one might be.
+    def take(self):
+        self._refill()
+        now = time.monotonic()
+        if now < self._paused_until or self._tokens < 1:
+            return max(self._paused_until - now, (1 - self._tokens) / self.rate)
+        self._tokens -= 1
+        return 0.0
+
+    # Drains the bucket and hands out nothing for the given time.
+    def pause(self, seconds):
+        self._tokens = 0.0
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def available(self):
+        self._refill()
+        return self._tokens
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+class RequestScheduler:
+
+    def __init__(self, rate=2.0, burst=5, max_concurrent=4, bucket=None):
+        # Token bucket limiting the request rate. Pass a shared one to
+        # split a rate limit between processes.
+        self.bucket = bucket or TokenBucket(rate, burst)
+
+        # Concurrency cap.
+        self.max_concurrent = max_concurrent
+        self._in_flight = 0
+
+        # Waiters: heap of (priority, seq, future, enqueued_at).
+        self._queue = []
+        self._seq = itertools.count()
+        self._timer = None
+
+        # Wait-time stats per priority: [count, total, max].
+        self._waits = {p: [0, 0.0, 0.0] for p in PRIORITY_NAMES}
+
+    # Holds a request slot for the duration of the block.
+    @asynccontextmanager
+    async def slot(self, priority=None):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    # Waits until a token and a concurrency slot are free.
+    async def acquire(self, priority=None):
+        if priority is None:
+            priority = request_priority.get()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future, time.monotonic()))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Granted a slot just as we gave up; hand it back.
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    # Called when MAL says we're going too fast. Drains the bucket and
+    # holds every queued request for the given time.
+    def backoff(self, seconds=5.0):
+        self.bucket.pause(seconds)
+        self._dispatch()
+
+    # Hands out slots to the highest-priority waiters while allowed.
+    def _dispatch(self):
+        while self._queue and self._in_flight < self.max_concurrent:
+            if self._queue[0][2].done():
+                heapq.heappop(self._queue)  # Waiter was cancelled.
+                continue
+            delay = self.bucket.take()
+            if delay > 0:
+                self._scheduleDispatch(delay)
+                return
+
+            priority, _, future, enqueued_at = heapq.heappop(self._queue)
+            now = time.monotonic()
+            self._in_flight += 1
+            wait = now - enqueued_at
+            stats = self._waits[priority]
+            stats[0] += 1
+            stats[1] += wait
+            stats[2] = max(stats[2], wait)
+            future.set_result(None)
+
+    def _scheduleDispatch(self, delay):
+        if self._timer is not None:
+            return
+        self._timer = asyncio.get_running_loop().call_later(max(delay, 0.0), self._onTimer)
+
+    def _onTimer(self):
+        self._timer = None
+        self._dispatch()
+
+    # Queue depth, in-flight count and wait times per priority.
+    def stats(self):
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future, _ in self._queue:
+            if not future.done():
+                depth[PRIORITY_NAMES[priority]] += 1
+        waits = {}
+        for priority, (count, total, longest) in self._waits.items():
+            waits[PRIORITY_NAMES[priority]] = {'count': count,
+                                               'avg_wait': total / count if count else 0.0,
+                                               'max_wait': longest}
+        return {'queue_depth': depth,
+                'in_flight': self._in_flight,
+                'tokens': round(self.bucket.available(), 2),
+                'waits': waits}
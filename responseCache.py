@@ -0,0 +1,130 @@
+# responseCache.py
+# TTL + LRU cache for MAL responses with stale-while-revalidate.
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from requestScheduler import BACKGROUND, setPriority
+
+class ResponseCache:
+
+    def __init__(self, max_entries=2048):
+        # key -> [value, fresh_until, stale_until, generation], least
+        # recently used first.
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+        # Keys with a background refresh in progress, and the tasks themselves
+        # (held so they aren't garbage collected mid-flight).
+        self._refreshing = set()
+        self._tasks = set()
+
+        # Every stored response gets a new generation number. Things derived
+        # from cached responses (like rendered replies) compare generations
+        # to know they're outdated.
+        self._next_generation = itertools.count(1)
+
+        # Counters.
+        self.hits = 0
+        self.stale_hits = 0
+        self.fallback_hits = 0
+        self.misses = 0
+
+    # Builds a cache key from the endpoint and its parameters.
+    # Order and case of parameters don't matter to MAL, so they don't here.
+    @staticmethod
+    def makeKey(url, parameters):
+        normalized = tuple(sorted((k, str(v).strip().lower()) for k, v in parameters.items()))
+        return (url.lower(), normalized)
+
+    # Returns the cached value for key, or awaits loader() on a miss.
+    # Expired entries still inside their stale window are returned at once
+    # while loader() refreshes them in the background. If loader() fails,
+    # an expired entry is returned rather than nothing.
+    # ttl may be a number of seconds or a function of the loaded value.
+    async def get(self, key, loader, ttl, stale_ttl=None):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fresh_until, stale_until, _ = entry
+            now = time.monotonic()
+            if now < fresh_until:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            if now < stale_until:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                self._refresh(key, loader, ttl, stale_ttl)
+                return value
+
+        self.misses += 1
+        value = await loader()
+        if value != False:
+            self.put(key, value, ttl, stale_ttl)
+            return value
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.fallback_hits += 1
+            return entry[0]
+        return value
+
+    # Stores value under key. Failed responses are never cached.
+    def put(self, key, value, ttl, stale_ttl=None):
+        if callable(ttl):
+            ttl = ttl(value)
+        if stale_ttl is None:
+            stale_ttl = ttl
+        now = time.monotonic()
+        self._entries[key] = [value, now + ttl, now + ttl + stale_ttl, next(self._next_generation)]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # Returns the value for key if it's still fresh, None otherwise.
+    def peek(self, key):
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() >= entry[1]:
+            return None
+        return entry[0]
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    # Generation of the response cached under key, 0 if there's none.
+    # Changes whenever the response is refreshed, and never comes back
+    # once it's evicted.
+    def generation(self, key):
+        entry = self._entries.get(key)
+        return entry[3] if entry is not None else 0
+
+    # Starts a background refresh for key unless one is already running.
+    def _refresh(self, key, loader, ttl, stale_ttl):
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def run():
+            setPriority(BACKGROUND)
+            try:
+                value = await loader()
+                if value != False:
+                    self.put(key, value, ttl, stale_ttl)
+            finally:
+                self._refreshing.discard(key)
+
+        task = asyncio.ensure_future(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # Hit/miss counters and size.
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'fallback_hits': self.fallback_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+                'entries': len(self._entries)}
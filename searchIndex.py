@@ -0,0 +1,108 @@
+# searchIndex.py
+# In-process trigram index over anime titles, for search and autocomplete.
+from collections import Counter, defaultdict
+from itertools import chain
+
+# Normalizes a title for indexing: lowercase, alphanumerics and single spaces.
+def normalize(text):
+    chars = [c if c.isalnum() else " " for c in text.lower()]
+    return " ".join("".join(chars).split())
+
+# Returns the set of trigrams in an already normalized string.
+# Padding lets one- and two-letter queries still match word starts.
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SearchIndex:
+
+    def __init__(self, candidates=50, common_fraction=0.02, common_min=200):
+        self.titles = {}    # id -> display title
+        self._names = {}    # id -> tuple of normalized names
+        self._postings = defaultdict(set)  # trigram -> ids
+
+        # How many trigram matches get re-ranked per lookup.
+        self.candidates = candidates
+
+        # Trigrams found in more titles than this fraction of the index
+        # (" no", "the", ...) are too common to narrow a search down, so
+        # candidates are gathered from the rarer ones only.
+        self.common_fraction = common_fraction
+        self.common_min = common_min
+
+    def __len__(self):
+        return len(self.titles)
+
+    # Adds or updates every anime in a list of AnimeRecords.
+    def addRecords(self, records):
+        for record in records:
+            if not record.title:
+                continue
+            anime_id = record.id
+            names = (record.title,) + record.alt_titles
+            names = tuple(dict.fromkeys(n for n in map(normalize, names) if n))
+
+            # Nothing new learned about this one.
+            old_names = self._names.get(anime_id)
+            if old_names is not None and set(names) <= set(old_names):
+                self.titles[anime_id] = record.title
+                continue
+            if old_names is not None:
+                names = tuple(dict.fromkeys(old_names + names))
+                self._unindex(anime_id)
+
+            self.titles[anime_id] = record.title
+            self._names[anime_id] = names
+            for gram in set().union(*map(trigrams, names)):
+                self._postings[gram].add(anime_id)
+
+    def _unindex(self, anime_id):
+        for gram in set().union(*map(trigrams, self._names[anime_id])):
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(anime_id)
+                if len(ids) == 0:
+                    del self._postings[gram]
+
+    # Returns up to limit (score, id, title) tuples, best first.
+    # Score is the fraction of the query's trigrams found in the title, plus
+    # a bonus when a title starts with or equals the query.
+    def search(self, query, limit=10, min_score=0.0):
+        query = normalize(query)
+        if query == "":
+            return []
+        query_grams = trigrams(query)
+
+        # Count shared trigrams per anime (Counter does the loop in C), from
+        # the rarest up. Common ones are only walked while fewer than a quarter
+        # of the query's trigrams have been.
+        postings = sorted((ids for ids in map(self._postings.get, query_grams) if ids), key=len)
+        common = max(self.common_min, int(len(self.titles) * self.common_fraction))
+        wanted = (len(query_grams) + 3) // 4
+        used = [ids for i, ids in enumerate(postings) if i < wanted or len(ids) <= common]
+        counts = Counter(chain.from_iterable(used))
+        if len(counts) == 0:
+            return []
+
+        # Re-rank the best candidates on all the query's trigrams, with
+        # prefix/exact bonuses.
+        total = len(query_grams)
+        best = counts.most_common(self.candidates)
+        results = []
+        for anime_id, _ in best:
+            # A trigram is in a name exactly when it's a substring of the
+            # padded name, which is cheaper to test than building the set.
+            padded = "|".join(f"  {name} " for name in self._names[anime_id])
+            score = sum(gram in padded for gram in query_grams) / total
+            for name in self._names[anime_id]:
+                if name == query:
+                    score += 1.0
+                    break
+                if name.startswith(query):
+                    score += 0.5
+                    break
+            if score >= min_score:
+                title = self.titles[anime_id]
+                results.append((score, -len(title), anime_id, title))
+        results.sort(reverse=True)
+        return [(score, anime_id, title) for score, _, anime_id, title in results[:limit]]
@@ -0,0 +1,103 @@
+# sharedRateLimit.py
+# Token bucket kept in SQLite, so every bot process on the machine draws
+# from one MAL rate limit (and a 429 seen by one pauses them all). Same
+# interface as requestScheduler.TokenBucket. Give it a file of its own:
+# it runs on the event loop and must never wait behind the store's
+# long write transactions.
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limits (
+    name         TEXT PRIMARY KEY,
+    tokens       REAL NOT NULL,
+    updated_at   REAL NOT NULL,
+    paused_until REAL NOT NULL
+);
+"""
+
+class SharedTokenBucket:
+
+    def __init__(self, path, rate=2.0, burst=5, name="mal", retry_after=0.02):
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+
+        # Autocommit mode, so each take is its own short IMMEDIATE
+        # transaction. There's no busy timeout: if another process holds
+        # the lock, take() says to try again in retry_after seconds and the
+        # scheduler's timer does, instead of blocking the loop.
+        self.retry_after = retry_after
+        self._conn = sqlite3.connect(path, timeout=0, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.execute("INSERT OR IGNORE INTO rate_limits (name, tokens, updated_at, paused_until) "
+                           "VALUES (?, ?, ?, 0)", (name, float(burst), time.time()))
+
+        # A pause that hasn't been written yet because the lock was busy.
+        # It holds locally at once and is written by the next transaction.
+        self._unsaved_pause = 0.0
+
+    # Runs fn(tokens, paused_until, now) inside a write transaction. fn
+    # returns (new tokens, new paused_until, result).
+    def _update(self, fn):
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            return None  # Another process holds the lock.
+        try:
+            tokens, updated_at, paused_until = self._conn.execute(
+                "SELECT tokens, updated_at, paused_until FROM rate_limits WHERE name = ?",
+                (self.name,)).fetchone()
+            # Wall clock time, since it's compared across processes.
+            now = time.time()
+            tokens = min(self.burst, tokens + max(now - updated_at, 0.0) * self.rate)
+            if self._unsaved_pause > paused_until:
+                tokens, paused_until = 0.0, self._unsaved_pause
+            tokens, paused_until, result = fn(tokens, paused_until, now)
+            self._conn.execute("UPDATE rate_limits SET tokens = ?, updated_at = ?, paused_until = ? WHERE name = ?",
+                               (tokens, now, paused_until, self.name))
+            self._conn.execute("COMMIT")
+            self._unsaved_pause = 0.0
+            return result
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    # Takes a token if one is free. Returns 0 on success, otherwise the
+    # seconds until one might be.
+    def take(self):
+        def fn(tokens, paused_until, now):
+            if now < paused_until or tokens < 1:
+                return tokens, paused_until, max(paused_until - now, (1 - tokens) / self.rate)
+            return tokens - 1, paused_until, 0.0
+        result = self._update(fn)
+        if result is None:
+            return max(self.retry_after, self._unsaved_pause - time.time())
+        return result
+
+    # Drains the bucket and hands out nothing for the given time. If the
+    # lock is busy the pause is kept locally and written by the next take().
+    def pause(self, seconds):
+        self._unsaved_pause = max(self._unsaved_pause, time.time() + seconds)
+        self._update(lambda tokens, paused_until, now: (0.0, paused_until, None))
+
+    # Tokens free right now. A plain read, so it never waits on the lock.
+    def available(self):
+        try:
+            row = self._conn.execute("SELECT tokens, updated_at, paused_until FROM rate_limits WHERE name = ?",
+                                     (self.name,)).fetchone()
+        except sqlite3.OperationalError:
+            return 0.0
+        if row is None:
+            return 0.0
+        tokens, updated_at, paused_until = row
+        now = time.time()
+        if now < max(paused_until, self._unsaved_pause):
+            return 0.0
+        return min(self.burst, tokens + max(now - updated_at, 0.0) * self.rate)
+
+    def close(self):
+        self._conn.close()